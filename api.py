@@ -0,0 +1,241 @@
+from datetime import datetime, timezone
+import tempfile
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+import ratelimit
+import storage
+from notes import (EXPIRATION_TYPES, ID_ATTEMPTS, allocate_note_id, expiry_after, new_note_id,
+                   parse_expiration_type, store_note)
+from storage import NOTE_EXPIRED, NOTE_LAST_VIEW, NOTE_MISSING
+
+# JSON API for scripts and CLIs: no redirects, no template rendering
+api = Blueprint('api', __name__, url_prefix='/api')
+
+DEFAULT_MAX_VIEWS = 1000
+DEFAULT_MAX_TTL = 30 * 24 * 3600
+DEFAULT_MAX_BATCH = 1000
+DEFAULT_RAW_MAX_SIZE = 16 * 1024 * 1024
+# Request bodies are copied in chunks of this size; spooled uploads stay in
+# memory up to the same size before moving to a temporary file
+STREAM_CHUNK = 64 * 1024
+
+
+class ValidationError(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+# A chunked upload ran through the client's create budget while being read
+class UploadRateLimited(ValueError):
+    def __init__(self, wait):
+        super().__init__(wait)
+        self.wait = wait
+
+
+# Every answer here carries a note body or a link to one (errors are cheap
+# to regenerate), so none of them may be kept by a browser or proxy cache
+@api.after_request
+def no_store(response):
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def error(message, status):
+    return jsonify(error=message), status
+
+
+def note_url(note_id):
+    return request.url_root + 'note/' + note_id
+
+
+# Optional positive integer field no larger than limit
+def positive_int(payload, field, limit):
+    value = payload.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= limit:
+        raise ValidationError(f'{field} must be an integer between 1 and {limit}')
+    return value
+
+
+# Validate one note payload and return (content, max_views, expires_at).
+# Accepts either max_views/ttl (seconds) or one of the form's expiration_type
+# strings; with neither, the note is single-view like the form's default.
+def parse_note(payload):
+    if not isinstance(payload, dict):
+        raise ValidationError('expected a JSON object')
+    content = payload.get('content')
+    if not isinstance(content, str) or not content.strip():
+        raise ValidationError('content must be a non-empty string')
+    return (content,) + parse_expiry(payload)
+
+
+# Validate the expiry fields of a payload and return (max_views, expires_at)
+def parse_expiry(payload):
+    expiration_type = payload.get('expiration_type')
+    if expiration_type is not None:
+        if expiration_type not in EXPIRATION_TYPES:
+            raise ValidationError('unknown expiration_type')
+        return parse_expiration_type(expiration_type)
+
+    max_views = positive_int(payload, 'max_views',
+                             current_app.config.get('API_MAX_VIEWS', DEFAULT_MAX_VIEWS))
+    ttl = positive_int(payload, 'ttl', current_app.config.get('API_MAX_TTL', DEFAULT_MAX_TTL))
+    if max_views is None and ttl is None:
+        max_views = 1
+    expires_at = expiry_after(ttl) if ttl else None
+    return max_views, expires_at
+
+
+# Copy the request body into a spooled temporary file chunk by chunk, so
+# memory stays flat whatever the upload size. Returns (file, size).
+# A body without a Content-Length is charged to the rate limit as it comes.
+def spool_body(limit):
+    if request.content_length is not None and request.content_length > limit:
+        raise BodyTooLarge()
+    spool = tempfile.SpooledTemporaryFile(max_size=STREAM_CHUNK)
+    size = 0
+    while True:
+        chunk = request.stream.read(STREAM_CHUNK)
+        if not chunk:
+            break
+        read, size = size, size + len(chunk)
+        if size > limit:
+            spool.close()
+            raise BodyTooLarge()
+        if request.content_length is None:
+            wait = ratelimit.charge_upload(read, size)
+            if wait:
+                spool.close()
+                raise UploadRateLimited(wait)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, size
+
+
+def describe(note_id, max_views, expires_at):
+    return {
+        'id': note_id,
+        'url': note_url(note_id),
+        'max_views': max_views,
+        'expires_at': datetime.fromtimestamp(expires_at, timezone.utc).isoformat() if expires_at else None,
+    }
+
+
+@api.route('/notes', methods=['POST'])
+def create_note():
+    try:
+        content, max_views, expires_at = parse_note(request.get_json(silent=True))
+    except ValidationError as exc:
+        return error(str(exc), 400)
+
+    note_id = store_note(storage.get_storage(), content, max_views, expires_at)
+    return jsonify(describe(note_id, max_views, expires_at)), 201
+
+
+# Create many notes in one request and one transaction. Invalid items are
+# reported individually and don't stop the valid ones from being created.
+@api.route('/notes/batch', methods=['POST'])
+def create_notes():
+    payload = request.get_json(silent=True)
+    items = payload.get('notes') if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        return error('expected a JSON object with a "notes" list', 400)
+    max_batch = ratelimit.max_batch(current_app.config.get('API_MAX_BATCH', DEFAULT_MAX_BATCH))
+    if len(items) > max_batch:
+        return error(f'at most {max_batch} notes per batch', 413)
+    wait = ratelimit.charge_batch(len(items))
+    if wait:
+        return ratelimit.too_many_requests(wait)
+
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        try:
+            content, max_views, expires_at = parse_note(item)
+        except ValidationError as exc:
+            results[index] = {'index': index, 'error': str(exc)}
+            continue
+        pending.append((index, [new_note_id(), content, max_views, expires_at]))
+
+    store = storage.get_storage()
+    for _ in range(ID_ATTEMPTS):
+        if not pending:
+            break
+        conflicts = set(store.create_many([tuple(note) for _, note in pending]))
+        for position, (index, note) in enumerate(pending):
+            if position not in conflicts:
+                results[index] = dict(describe(note[0], note[2], note[3]), index=index)
+        pending = [entry for position, entry in enumerate(pending) if position in conflicts]
+        for _, note in pending:
+            note[0] = new_note_id()
+    for index, _ in pending:
+        results[index] = {'index': index, 'error': 'could not allocate a note id'}
+
+    created = sum(1 for result in results if 'id' in result)
+    return jsonify(created=created, failed=len(results) - created, results=results)
+
+
+# Raw-text mode for very large notes: the request body is the note, expiry
+# comes from the query string (?max_views=3&ttl=600), and the body is
+# streamed into storage rather than parsed into memory.
+@api.route('/notes/raw', methods=['POST'])
+def create_note_raw():
+    # isdigit() alone also accepts digits int() can't parse, like '²'
+    args = {key: int(value) if value.isascii() and value.isdigit() else value
+            for key, value in request.args.items()}
+    try:
+        max_views, expires_at = parse_expiry(args)
+    except ValidationError as exc:
+        return error(str(exc), 400)
+
+    limit = current_app.config.get('RAW_NOTE_MAX_SIZE', DEFAULT_RAW_MAX_SIZE)
+    try:
+        spool, size = spool_body(limit)
+    except BodyTooLarge:
+        return error(f'note body larger than {limit} bytes', 413)
+    except UploadRateLimited as exc:
+        return ratelimit.too_many_requests(exc.wait)
+
+    with spool:
+        if not size:
+            return error('request body is empty', 400)
+        store = storage.get_storage()
+
+        def create(note_id):
+            spool.seek(0)
+            store.create_from_stream(note_id, spool, size, max_views, expires_at)
+
+        note_id = allocate_note_id(create)
+    return jsonify(dict(describe(note_id, max_views, expires_at), size=size)), 201
+
+
+# Stream a note body back as text/plain in chunks. Uses up a view like any
+# other read; X-Note-Deleted tells the client whether this was the last one.
+@api.route('/notes/<note_id>/raw')
+def get_note_raw(note_id):
+    status, chunks = storage.get_storage().consume_view_stream(note_id)
+    if status == NOTE_MISSING:
+        ratelimit.count_miss()
+        return error('not_found', 404)
+    if status == NOTE_EXPIRED:
+        return error('expired', 410)
+    response = Response(chunks, mimetype='text/plain')
+    response.headers['X-Note-Deleted'] = 'true' if status == NOTE_LAST_VIEW else 'false'
+    return response
+
+
+# Reading through the API uses up a view exactly like /note/<id>
+@api.route('/notes/<note_id>')
+def get_note(note_id):
+    status, content = storage.get_storage().consume_view(note_id)
+    if status == NOTE_MISSING:
+        ratelimit.count_miss()
+        return error('not_found', 404)
+    if status == NOTE_EXPIRED:
+        return error('expired', 410)
+    return jsonify(id=note_id, content=content, deleted=status == NOTE_LAST_VIEW)
@@ -1,139 +1,148 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from datetime import datetime, timedelta
-import sqlite3
+from datetime import datetime
+import os
 import secrets
-import string
 
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+import assets
+import bloom
+import cache
+import metrics
+import pages
+import profiling
+import ratelimit
+import storage
+import sweeper
+from api import api
+from notes import parse_expiration_type, store_note
+from storage import NOTE_EXPIRED, NOTE_LAST_VIEW, NOTE_MISSING
 
-# Database initialization
-def init_db():
-    conn = sqlite3.connect('notes.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notes (
-            id TEXT PRIMARY KEY,
-            content TEXT NOT NULL,
-            max_views INTEGER,
-            current_views INTEGER DEFAULT 0,
-            expires_at DATETIME,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+# Build the app. Settings come from the environment; config overrides them
+# (handy for scripts and benchmarks). No threads are started and no files are
+# touched here: storage prepares itself on first use and templates compile on
+# first render, so a preloading server can call it before forking its workers
+# and a cold process gets to its first response sooner.
+def create_app(config=None):
+    app = Flask(__name__)
+    # Must be the same in every worker, or a flash message set by one can't be
+    # read by another. The random fallback is only fit for a single process.
+    app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
+    app.config['DATABASE'] = os.environ.get('DATABASE_PATH', 'notes.db')
+    app.config['DATABASE_SHARDS'] = int(os.environ.get('DATABASE_SHARDS', 1))
+    app.config['STORAGE_URL'] = os.environ.get('STORAGE_URL')
+    app.config['SWEEP_INTERVAL'] = float(os.environ.get('SWEEP_INTERVAL', 0))
+    app.config['NOTE_CACHE_SIZE'] = int(os.environ.get('NOTE_CACHE_SIZE', 1024))
+    app.config['CONTENT_COMPRESSION'] = os.environ.get('CONTENT_COMPRESSION', 'zlib')
+    app.config['COMPRESSION_THRESHOLD'] = int(os.environ.get('COMPRESSION_THRESHOLD', 1024))
+    app.config['DEDUP_MIN_SIZE'] = int(os.environ.get('DEDUP_MIN_SIZE', 0))
+    app.config['RAW_NOTE_MAX_SIZE'] = int(os.environ.get('RAW_NOTE_MAX_SIZE', 16 * 1024 * 1024))
+    app.config['NOTE_ID_LENGTH'] = int(os.environ.get('NOTE_ID_LENGTH', 12))
+    app.config['NOTE_ID_ALPHABET'] = os.environ.get('NOTE_ID_ALPHABET', 'base62')
+    app.config['VIEW_LEASE_SIZE'] = int(os.environ.get('VIEW_LEASE_SIZE', 0))
+    app.config['VIEW_LEASE_TTL'] = float(os.environ.get('VIEW_LEASE_TTL', 1.0))
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILE_INTERVAL'] = float(os.environ.get('PROFILE_INTERVAL', profiling.DEFAULT_INTERVAL))
+    app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+    app.config['RATE_LIMIT_CREATE'] = os.environ.get('RATE_LIMIT_CREATE')
+    app.config['RATE_LIMIT_VIEW'] = os.environ.get('RATE_LIMIT_VIEW')
+    app.config['RATE_LIMIT_MISS'] = os.environ.get('RATE_LIMIT_MISS')
+    app.config['RATE_LIMIT_URL'] = os.environ.get('RATE_LIMIT_URL')
+    app.config['RATE_LIMIT_KEY_HEADER'] = os.environ.get('RATE_LIMIT_KEY_HEADER')
+    app.config['RATE_LIMIT_MAX_CLIENTS'] = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', ratelimit.DEFAULT_MAX_CLIENTS))
+    app.config['RATE_LIMIT_CREATE_BYTES'] = int(os.environ.get('RATE_LIMIT_CREATE_BYTES', ratelimit.DEFAULT_CREATE_BYTES))
+    app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR')
+    app.config['NEGATIVE_FILTER'] = os.environ.get('NEGATIVE_FILTER', '') not in ('', '0')
+    app.config['NEGATIVE_FILTER_CAPACITY'] = int(os.environ.get('NEGATIVE_FILTER_CAPACITY', 1000000))
+    app.config['NEGATIVE_FILTER_REBUILD_INTERVAL'] = float(os.environ.get('NEGATIVE_FILTER_REBUILD_INTERVAL', 3600))
+    if config:
+        app.config.update(config)
 
-# Generate unique note ID
-def generate_note_id(length=12):
-    characters = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(characters) for _ in range(length))
+    assets.init_app(app)
+    cache.init_app(app)
+    pages.init_app(app)
+    storage.init_app(app)
+    bloom.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    ratelimit.init_app(app)
+    sweeper.init_app(app)
+    app.register_blueprint(api)
 
-# Check if note is expired
-def is_note_expired(note):
-    if note['expires_at'] and datetime.fromisoformat(note['expires_at']) <= datetime.now():
-        return True
-    if note['max_views'] and note['current_views'] >= note['max_views']:
-        return True
-    return False
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/create', view_func=create_note, methods=['POST'])
+    app.add_url_rule('/success/<note_id>', view_func=success)
+    app.add_url_rule('/note/<note_id>', view_func=view_note)
+    return app
 
-# Delete expired note
-def delete_note(note_id):
-    conn = sqlite3.connect('notes.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM notes WHERE id = ?', (note_id,))
-    conn.commit()
-    conn.close()
+# Create the schema (and the note id filter) and compile the templates up
+# front rather than on the first request. The gunicorn config does it in the
+# master, so forked workers start with both done.
+def init_db(flask_app=None):
+    flask_app = flask_app or app
+    storage.prepare(flask_app)
+    pages.warm_templates(flask_app)
+
+# Drop pooled connections before forking workers: SQLite connections (and
+# Redis sockets) must not be shared between processes
+def before_fork(app):
+    storage.get_storage(app).release_connections()
 
-@app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/create', methods=['POST'])
 def create_note():
-    content = request.form.get('content', '').strip()
-    expiration_type = request.form.get('expiration_type')
+    content, max_views, expires_at = read_note_form()
     
     if not content:
-        flash('Please enter some content for your note.', 'error')
-        return redirect(url_for('index'))
-    
-    note_id = generate_note_id()
-    max_views = None
-    expires_at = None
-    
-    # Parse expiration settings
-    if expiration_type == '1_view':
-        max_views = 1
-    elif expiration_type == '5_views':
-        max_views = 5
-    elif expiration_type == '10_views':
-        max_views = 10
-    elif expiration_type == '10_minutes':
-        expires_at = datetime.now() + timedelta(minutes=10)
-    elif expiration_type == '1_hour':
-        expires_at = datetime.now() + timedelta(hours=1)
-    elif expiration_type == '24_hours':
-        expires_at = datetime.now() + timedelta(hours=24)
+        return empty_note()
     
     # Save to database
-    conn = sqlite3.connect('notes.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO notes (id, content, max_views, expires_at)
-        VALUES (?, ?, ?, ?)
-    ''', (note_id, content, max_views, expires_at.isoformat() if expires_at else None))
-    conn.commit()
-    conn.close()
+    note_id = store_note(storage.get_storage(), content, max_views, expires_at)
     
     return redirect(url_for('success', note_id=note_id))
 
-@app.route('/success/<note_id>')
+# The /create form as (content, max_views, expires_at)
+def read_note_form():
+    content = request.form.get('content', '').strip()
+    max_views, expires_at = parse_expiration_type(request.form.get('expiration_type'))
+    return content, max_views, expires_at
+
+def empty_note():
+    flash('Please enter some content for your note.', 'error')
+    return redirect(url_for('index'))
+
 def success(note_id):
     note_url = request.url_root + 'note/' + note_id
-    return render_template('success.html', note_url=note_url, note_id=note_id)
+    response = pages.parameterized_page('success.html', note_url=note_url, note_id=note_id)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
-@app.route('/note/<note_id>')
 def view_note(note_id):
-    conn = sqlite3.connect('notes.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM notes WHERE id = ?', (note_id,))
-    note = cursor.fetchone()
-    
-    if not note:
-        conn.close()
-        return render_template('expired.html', message="This note does not exist or has already been deleted.")
-    
-    # Convert to dict for easier handling
-    note = dict(note)
-    
-    # Check if expired
-    if is_note_expired(note):
-        delete_note(note_id)
-        conn.close()
-        return render_template('expired.html', message="This note has expired and been deleted.")
+    status, content = storage.get_storage().consume_view(note_id)
+    return note_page(status, content)
+
+# Page for the outcome of consume_view
+def note_page(status, content):
+    if status == NOTE_MISSING:
+        ratelimit.count_miss()
+        return pages.static_page('expired.html', message="This note does not exist or has already been deleted.")
     
-    # Increment view count
-    new_view_count = note['current_views'] + 1
-    cursor.execute('UPDATE notes SET current_views = ? WHERE id = ?', (new_view_count, note_id))
-    conn.commit()
+    if status == NOTE_EXPIRED:
+        return pages.static_page('expired.html', message="This note has expired and been deleted.")
     
-    # Check if this view causes expiration
-    note['current_views'] = new_view_count
-    if is_note_expired(note):
-        delete_note(note_id)
-        conn.close()
-        return render_template('view_note.html', content=note['content'], 
+    # This view used up the last allowed view
+    if status == NOTE_LAST_VIEW:
+        return render_template('view_note.html', content=content, 
                              message="This note has been deleted after viewing.",
                              accessed_time=datetime.now().strftime('%b %d, %Y %H:%M'))
     
-    conn.close()
-    return render_template('view_note.html', content=note['content'],
+    return render_template('view_note.html', content=content,
                          accessed_time=datetime.now().strftime('%b %d, %Y %H:%M'))
 
+app = create_app()
+
 if __name__ == '__main__':
-    import os
+    init_db()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
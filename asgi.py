@@ -0,0 +1,238 @@
+"""ASGI entry point.
+
+Serves the same app from an event loop. The hot routes (/create,
+/note/<id>, /success/<id>) run only their storage calls - SQLite I/O and
+commit fsyncs - on a bounded thread pool and render on the loop, so a slow
+disk ties up pool threads rather than connections. Every other route runs as
+plain WSGI on the same pool.
+
+    uvicorn asgi:application --workers 4
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+ASGI_DB_THREADS caps concurrent storage work per process (default 8, the
+size of the SQLite connection pool's idle list).
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import redirect, request, url_for
+from werkzeug.exceptions import HTTPException
+
+import profiling
+import storage
+from app import app as flask_app, empty_note, note_page, read_note_form
+from notes import store_note
+
+DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', 8))
+# Request bodies are held in memory up to this size, then spooled to disk
+SPOOL_SIZE = 1024 * 1024
+# Larger bodies are refused before the app sees them
+MAX_BODY = flask_app.config.get('MAX_CONTENT_LENGTH') or flask_app.config['RAW_NOTE_MAX_SIZE'] + SPOOL_SIZE
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='asgi-db')
+    return _executor
+
+
+# Run a blocking call on the pool, carrying the current Flask app/request
+# context along so the call can still use current_app (and is profiled with
+# its request).
+async def run_blocking(func, *args):
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), context.run, profiling.call, func, *args)
+
+
+async def create_note():
+    content, max_views, expires_at = read_note_form()
+    if not content:
+        return empty_note()
+    note_id = await run_blocking(store_note, storage.get_storage(), content, max_views, expires_at)
+    return redirect(url_for('success', note_id=note_id))
+
+
+async def view_note(note_id):
+    status, content = await run_blocking(storage.get_storage().consume_view, note_id)
+    return note_page(status, content)
+
+
+async def success(note_id):
+    return flask_app.view_functions['success'](note_id)
+
+
+# Endpoints served natively; everything else goes through the WSGI app
+HANDLERS = {
+    'create_note': create_note,
+    'view_note': view_note,
+    'success': success,
+}
+
+
+def build_environ(scope, body, length):
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+# read_body's answer when the client went away before sending the whole body
+DISCONNECTED = object()
+
+
+# Read the whole request body into a spooled file. Returns (file, length),
+# None when the body is larger than MAX_BODY, or DISCONNECTED.
+async def read_body(receive):
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    length = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return DISCONNECTED
+        chunk = message.get('body', b'')
+        length += len(chunk)
+        if length > MAX_BODY:
+            body.close()
+            return None
+        body.write(chunk)
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body, length
+
+
+# The native counterpart of Flask.wsgi_app for one HANDLERS endpoint
+async def dispatch(handler, environ):
+    ctx = flask_app.request_context(environ)
+    error = None
+    try:
+        ctx.push()
+        try:
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await handler(**request.view_args)
+        except Exception as e:
+            rv = flask_app.handle_user_exception(e)
+        response = flask_app.finalize_request(rv)
+    except Exception as e:
+        error = e
+        response = flask_app.handle_exception(e)
+    finally:
+        ctx.pop(error)
+    return response
+
+
+# Call a WSGI callable (the app, or an already built response) and return
+# (status, headers, body iterable)
+def call_wsgi(wsgi, environ):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    body = wsgi(environ, start_response)
+    return started['status'], started['headers'], body
+
+
+async def send_response(send, status, headers, body, blocking):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    chunks = iter(body)
+    try:
+        while True:
+            # Streamed bodies may read from SQLite as they go
+            chunk = await run_blocking(next, chunks, None) if blocking else next(chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _executor is not None:
+                _executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    read = await read_body(receive)
+    # A partial body must not be handled as if it were the whole note
+    if read is DISCONNECTED:
+        return
+    if read is None:
+        return await send_response(send, 413, [('Content-Type', 'text/plain')], [b'Request body too large'], False)
+    body, length = read
+    try:
+        environ = build_environ(scope, body, length)
+        try:
+            endpoint, _ = flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        handler = HANDLERS.get(endpoint)
+        if handler is not None:
+            response = await dispatch(handler, environ)
+            status, headers, chunks = call_wsgi(response, environ)
+            await send_response(send, status, headers, chunks, response.is_streamed)
+        else:
+            status, headers, chunks = await run_blocking(call_wsgi, flask_app, environ)
+            await send_response(send, status, headers, chunks, True)
+    finally:
+        body.close()
+
@@ -0,0 +1,403 @@
+"""Self-hosted, fingerprinted and precompressed static assets.
+
+Two steps, both run from the repository root:
+
+    python assets.py vendor     # download the third-party files into static/vendor/
+    python assets.py build      # write static/dist/ and its manifest
+    python assets.py build --prune      # ...and delete files from older builds
+    python assets.py check      # fail unless static/vendor/ is complete
+
+check (or build --require-vendor) exits non-zero while any file in VENDOR or
+static/vendor/sources.json is missing; run it before a release.
+
+vendor fetches the pinned Bootstrap, jQuery and Font Awesome files in VENDOR,
+plus every font or image their stylesheets (and ours) load with url(), and
+records where each came from in static/vendor/sources.json. Commit
+static/vendor/ so that builds don't need the network.
+
+build takes everything under static/ except dist/, minifies our own CSS and
+JS (with rcssmin/rjsmin when installed, otherwise a conservative built-in
+pass; *.min.* files are left alone), names each file after a hash of its
+content (css/style.3f2a9c1e0b7d.css), points url() references in
+stylesheets at the renamed files and writes a .gz (and with the brotli
+module a .br) of every file that compresses. static/dist/manifest.json maps
+the source names to the built ones.
+
+gunicorn.conf.py runs build whenever gunicorn starts (ASSETS_BUILD=0 to
+skip); run it by hand before starting any other server.
+
+With a manifest present, templates link to /assets/<built name>, served with
+a one-year immutable Cache-Control and the smallest variant the client's
+Accept-Encoding allows. The manifest is read at startup, so restart after a
+build. Without one, pages fall back to /static/ for files that exist there
+and to the CDN for vendor files that don't.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import sys
+import urllib.parse
+
+from flask import abort, current_app, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:  # optional; see minify_css
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:  # optional; see minify_js
+    rjsmin = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, 'static')
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+SOURCES = 'vendor/sources.json'
+
+# Third-party files by their name under static/, pinned to a version
+VENDOR = {
+    'vendor/bootstrap/css/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/js/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+    'vendor/jquery/jquery.min.js': 'https://code.jquery.com/jquery-3.7.1.min.js',
+    'vendor/fontawesome/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+}
+
+# Built files are never changed in place, so clients may keep them for good
+MAX_AGE = 365 * 24 * 3600
+FINGERPRINT_LENGTH = 12
+# Already compressed formats aren't worth a .gz/.br
+PRECOMPRESSED = frozenset({'.woff', '.woff2', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico'})
+# Preferred first when the client accepts both
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'''url\(\s*(?:"([^"]*)"|'([^']*)'|([^)\s]*))\s*\)''')
+SOURCE_MAP = re.compile(r'(?:/\*# sourceMappingURL=[^*]*\*/|//# sourceMappingURL=\S*)\s*$')
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.S)
+
+
+def _css_urls(css):
+    for match in CSS_URL.finditer(css):
+        url = next(group for group in match.groups() if group is not None)
+        if url and not url.startswith(('data:', '#')):
+            yield match, url
+
+
+# A reference as written in a stylesheet, less any ?query or #fragment
+def _split_ref(url):
+    cut = min((index for index in (url.find('?'), url.find('#')) if index >= 0), default=len(url))
+    return url[:cut], url[cut:]
+
+
+# ---- vendor ---------------------------------------------------------------
+
+def _fetch(url):
+    # Only `vendor` downloads anything; importing this costs the app startup
+    import urllib.request
+    req = urllib.request.Request(url, headers={'User-Agent': 'ephemeral-bin-assets'})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return response.read()
+
+
+# Where a file loaded by a stylesheet is kept: next to the stylesheet for
+# relative references from a vendored one, else under vendor/<host>/
+def _vendor_name(css_name, css_url, ref):
+    path, _ = _split_ref(ref)
+    if css_url and not urllib.parse.urlsplit(path).scheme:
+        name = posixpath.normpath(posixpath.join(posixpath.dirname(css_name), path))
+        return name, urllib.parse.urljoin(css_url, path)
+    parts = urllib.parse.urlsplit(path)
+    if parts.scheme not in ('http', 'https'):
+        return None, None
+    return posixpath.normpath(posixpath.join('vendor', parts.netloc, parts.path.lstrip('/'))), path
+
+
+def vendor(static_dir=STATIC_DIR, log=print):
+    sources = dict(VENDOR)
+    pending = list(VENDOR.items())
+    # Remote fonts and images our own stylesheets load are vendored too
+    for name in _walk(static_dir):
+        if name.endswith('.css') and not name.startswith(('vendor/', DIST + '/')):
+            pending.append((name, None))
+    seen = set()
+    while pending:
+        name, url = pending.pop(0)
+        if name in seen:
+            continue
+        seen.add(name)
+        path = os.path.join(static_dir, *name.split('/'))
+        if url:
+            log(f'{url} -> static/{name}')
+            data = _fetch(url)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(data)
+        elif os.path.exists(path):
+            with open(path, 'rb') as fh:
+                data = fh.read()
+        else:
+            continue
+        if not name.endswith('.css'):
+            continue
+        for _, ref in _css_urls(data.decode('utf-8')):
+            target, target_url = _vendor_name(name, url, ref)
+            if target is None or not target.startswith('vendor/'):
+                continue
+            sources[target] = target_url
+            pending.append((target, target_url))
+    path = os.path.join(static_dir, *SOURCES.split('/'))
+    with open(path, 'w') as fh:
+        json.dump(dict(sorted(sources.items())), fh, indent=2)
+        fh.write('\n')
+    return sources
+
+
+# VENDOR files and the sources record not present under static_dir, each
+# complained about on stderr
+def check_vendor(static_dir=STATIC_DIR):
+    missing = [name for name in list(VENDOR) + [SOURCES]
+               if not os.path.exists(os.path.join(static_dir, *name.split('/')))]
+    if missing:
+        print(f'static/vendor/ is incomplete, missing {", ".join(missing)}: run '
+              '`python assets.py vendor` and commit the result, or pages keep loading '
+              'third-party files from their CDNs', file=sys.stderr)
+    return missing
+
+
+# ---- build ----------------------------------------------------------------
+
+# Comments and runs of whitespace go; strings are left exactly as written
+def minify_css(css):
+    if rcssmin is not None:
+        return rcssmin.cssmin(css)
+    out = []
+    code = []
+    last = 0
+    for match in CSS_TOKENS.finditer(css):
+        code.append(css[last:match.start()])
+        if match.group(1) is None:
+            code.append(' ')
+        else:
+            out.append(_squeeze_css(''.join(code)))
+            out.append(match.group(1))
+            code = []
+        last = match.end()
+    code.append(css[last:])
+    out.append(_squeeze_css(''.join(code)))
+    return ''.join(out).strip()
+
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+    return text.replace(';}', '}')
+
+
+# Without rjsmin only indentation, blank lines and whole-line // comments
+# are dropped: line breaks stay, so automatic semicolon insertion and regex
+# literals are never affected. A template literal spanning lines leaves the
+# file as it is.
+def minify_js(js):
+    if rjsmin is not None:
+        return rjsmin.jsmin(js)
+    lines = [line.strip() for line in js.splitlines()]
+    if any(line.count('`') % 2 for line in lines):
+        return js
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def _walk(static_dir):
+    for root, dirs, files in os.walk(static_dir):
+        rel = os.path.relpath(root, static_dir).replace(os.sep, '/')
+        if rel == DIST:
+            dirs[:] = []
+            continue
+        for filename in files:
+            yield filename if rel == '.' else f'{rel}/{filename}'
+
+
+def fingerprinted(name, data):
+    root, ext = posixpath.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]}{ext}'
+
+
+# Point every url() at the built name of the file it loads
+def _rewrite_css(name, css, manifest, by_url):
+    def replace(match):
+        url = next(group for group in match.groups() if group is not None)
+        path, suffix = _split_ref(url)
+        if urllib.parse.urlsplit(path).scheme:
+            target = by_url.get(path)
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(name), path))
+        built = manifest.get(target)
+        if built is None:
+            return match.group(0)
+        return f'url("{posixpath.relpath(built, posixpath.dirname(name) or ".")}{suffix}")'
+    return CSS_URL.sub(replace, css)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+
+def _compressed(data):
+    yield '.gz', gzip.compress(data, 9, mtime=0)
+    if brotli is not None:
+        yield '.br', brotli.compress(data, quality=11)
+
+
+def build(static_dir=STATIC_DIR, prune=False, log=print):
+    dist = os.path.join(static_dir, DIST)
+    sources_path = os.path.join(static_dir, *SOURCES.split('/'))
+    by_url = {}
+    if os.path.exists(sources_path):
+        with open(sources_path) as fh:
+            by_url = {url: name for name, url in json.load(fh).items()}
+    names = sorted(name for name in _walk(static_dir) if name != SOURCES)
+    manifest = {}
+    written = set()
+    # Stylesheets last, so the files they load already have their built names
+    for name in sorted(names, key=lambda name: name.endswith('.css')):
+        with open(os.path.join(static_dir, *name.split('/')), 'rb') as fh:
+            data = fh.read()
+        ext = posixpath.splitext(name)[1]
+        if ext in ('.css', '.js'):
+            text = SOURCE_MAP.sub('', data.decode('utf-8'))
+            if '.min.' not in name:
+                text = minify_css(text) if ext == '.css' else minify_js(text)
+            if ext == '.css':
+                text = _rewrite_css(name, text, manifest, by_url)
+            data = text.encode('utf-8')
+        built = manifest[name] = fingerprinted(name, data)
+        path = os.path.join(dist, *built.split('/'))
+        written.add(path)
+        if not os.path.exists(path):
+            _write(path, data)
+            log(f'static/{name} -> static/{DIST}/{built} ({len(data)} bytes)')
+        if ext in PRECOMPRESSED:
+            continue
+        for suffix, packed in _compressed(data):
+            if len(packed) < len(data):
+                written.add(path + suffix)
+                if not os.path.exists(path + suffix):
+                    _write(path + suffix, packed)
+    # Swapped in whole, so a server starting meanwhile never reads half of it
+    manifest_path = os.path.join(dist, MANIFEST)
+    with open(manifest_path + '.tmp', 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+        fh.write('\n')
+    os.replace(manifest_path + '.tmp', manifest_path)
+    if prune:
+        for root, _, files in os.walk(dist):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if path not in written and path != manifest_path:
+                    os.remove(path)
+    return manifest
+
+
+# ---- serving --------------------------------------------------------------
+
+class Assets:
+    def __init__(self, static_dir, manifest):
+        self.dist = os.path.join(static_dir, DIST)
+        self.manifest = manifest
+        # built name -> content encodings with a precompressed variant on disk
+        self.variants = {
+            built: [(encoding, suffix) for encoding, suffix in ENCODINGS
+                    if os.path.exists(os.path.join(self.dist, *built.split('/')) + suffix)]
+            for built in manifest.values()
+        }
+
+    @classmethod
+    def load(cls, static_dir):
+        try:
+            with open(os.path.join(static_dir, DIST, MANIFEST)) as fh:
+                return cls(static_dir, json.load(fh))
+        except FileNotFoundError:
+            return None
+
+    def serve(self, filename):
+        variants = self.variants.get(filename)
+        if variants is None:
+            abort(404)
+        path = os.path.join(self.dist, *filename.split('/'))
+        encoding = None
+        for name, suffix in variants:
+            if request.accept_encodings[name]:
+                encoding = name
+                path += suffix
+                break
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_file(path, mimetype=mimetype, max_age=MAX_AGE, conditional=True)
+        response.cache_control.immutable = True
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if variants:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+def asset_url(name):
+    assets = current_app.extensions.get('assets')
+    if assets is not None and name in assets.manifest:
+        return url_for('asset', filename=assets.manifest[name])
+    if name in VENDOR and not os.path.exists(os.path.join(current_app.static_folder, *name.split('/'))):
+        return VENDOR[name]
+    return url_for('static', filename=name)
+
+
+# Serve static/dist/ under /assets/ if it has been built, and give templates
+# asset_url() either way
+def init_app(app):
+    app.add_template_global(asset_url)
+    assets = Assets.load(app.static_folder)
+    if assets is None:
+        return None
+    app.extensions['assets'] = assets
+    app.add_url_rule('/assets/<path:filename>', 'asset', assets.serve)
+    return assets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--static', default=STATIC_DIR, help='static directory (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('vendor', help='download the pinned third-party files')
+    build_cmd = commands.add_parser('build', help='minify, fingerprint and compress into static/dist/')
+    build_cmd.add_argument('--prune', action='store_true', help='delete files not in the new manifest')
+    build_cmd.add_argument('--require-vendor', action='store_true',
+                           help='fail instead of building while static/vendor/ is incomplete')
+    commands.add_parser('check', help='fail unless every vendored file is present')
+    args = parser.parse_args(argv)
+
+    if args.command == 'vendor':
+        vendor(args.static)
+        return 0
+    if check_vendor(args.static) and (args.command == 'check' or args.require_vendor):
+        return 1
+    if args.command == 'build':
+        manifest = build(args.static, args.prune)
+        print(f'{len(manifest)} files in {os.path.join(args.static, DIST, MANIFEST)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
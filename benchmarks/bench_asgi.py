@@ -0,0 +1,199 @@
+"""Concurrency per process: sync WSGI worker vs the ASGI entry point.
+
+Simulates a slow disk by adding a fixed delay to every storage call (roughly
+what a commit fsync costs on a busy or network-backed volume), then drives
+create + view cycles from many concurrent clients against:
+
+    sync   one process serving requests one at a time, like a sync gunicorn
+           worker (--sync-threads N for a gthread-style worker)
+    asgi   asgi.application on one event loop, storage calls on its
+           bounded pool (ASGI_DB_THREADS)
+
+Both are driven in-process, so HTTP parsing is left out of the numbers.
+
+    python benchmarks/bench_asgi.py --clients 64 --disk-latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FORM = urlencode({'content': 'benchmark note', 'expiration_type': '1_view'}).encode()
+
+
+# Storage wrapper that sleeps before each call, standing in for slow I/O
+class SlowStorage:
+    def __init__(self, inner, latency):
+        self.inner = inner
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if not callable(attr):
+            return attr
+
+        def slow(*args, **kwargs):
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return slow
+
+
+class Tracker:
+    def __init__(self):
+        self.latencies = []
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    # Requests being served right now (as opposed to queued for the worker)
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    # Latency as the client sees it, queueing included
+    def record(self, started):
+        with self._lock:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def summarize(mode, tracker, elapsed):
+    values = sorted(tracker.latencies)
+
+    def pct(fraction):
+        return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 1)
+
+    return {
+        'mode': mode,
+        'requests': len(values),
+        'requests_per_s': round(len(values) / elapsed, 1),
+        'peak_in_flight': tracker.peak,
+        'p50_ms': pct(0.50),
+        'p99_ms': pct(0.99),
+    }
+
+
+def run_sync(app, clients, duration, threads):
+    # The worker: one request at a time per thread, like gunicorn sync/gthread
+    worker = ThreadPoolExecutor(max_workers=threads)
+    tracker = Tracker()
+    deadline = time.perf_counter() + duration
+
+    def handle(method, path, data=None):
+        tracker.enter()
+        client = app.test_client()
+        if method == 'POST':
+            response = client.post(path, data=data, content_type='application/x-www-form-urlencoded')
+        else:
+            response = client.get(path)
+        response.close()
+        tracker.leave()
+        return response.headers.get('Location')
+
+    def request(*args):
+        started = time.perf_counter()
+        location = worker.submit(handle, *args).result()
+        tracker.record(started)
+        return location
+
+    def client_loop():
+        while time.perf_counter() < deadline:
+            location = request('POST', '/create', FORM)
+            request('GET', '/note/' + location.rsplit('/', 1)[1])
+
+    start = time.perf_counter()
+    loops = [threading.Thread(target=client_loop) for _ in range(clients)]
+    for thread in loops:
+        thread.start()
+    for thread in loops:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    worker.shutdown()
+    return summarize('sync' if threads == 1 else f'sync x{threads} threads', tracker, elapsed)
+
+
+async def asgi_request(application, tracker, method, path, body=b''):
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': b'',
+        'http_version': '1.1', 'scheme': 'http', 'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+        'headers': [(b'host', b'bench'), (b'content-type', b'application/x-www-form-urlencoded')],
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {}
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['headers'] = dict(message['headers'])
+
+    started = time.perf_counter()
+    tracker.enter()
+    await application(scope, receive, send)
+    tracker.leave()
+    tracker.record(started)
+    return response['headers'].get(b'location', b'').decode()
+
+
+async def run_asgi(application, clients, duration):
+    tracker = Tracker()
+    deadline = time.perf_counter() + duration
+
+    async def client_loop():
+        while time.perf_counter() < deadline:
+            location = await asgi_request(application, tracker, 'POST', '/create', FORM)
+            await asgi_request(application, tracker, 'GET', '/note/' + location.rsplit('/', 1)[1])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(clients)))
+    return summarize('asgi', tracker, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sync and ASGI serving under slow storage.')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=5, help='seconds per mode')
+    parser.add_argument('--disk-latency-ms', type=float, default=20)
+    parser.add_argument('--sync-threads', type=int, default=1,
+                        help='threads per sync worker (1 = gunicorn sync worker)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_PATH'] = os.path.join(tmp, 'bench.db')
+        import app as app_module
+        import asgi
+        app_module.init_db()
+        app = app_module.app
+        app.extensions['storage'] = SlowStorage(app.extensions['storage'], args.disk_latency_ms / 1000)
+
+        results = [run_sync(app, args.clients, args.duration, args.sync_threads),
+                   asyncio.run(run_asgi(asgi.application, args.clients, args.duration))]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{args.clients} clients, {args.disk_latency_ms:g} ms per storage call, '
+          f'{asgi.DB_THREADS} ASGI pool threads')
+    for result in results:
+        print(f"{result['mode']:<20}{result['requests_per_s']:>8} req/s  "
+              f"peak in flight {result['peak_in_flight']:<4}"
+              f"p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
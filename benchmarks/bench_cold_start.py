@@ -0,0 +1,150 @@
+"""Cold start: time from launching a fresh process to its first responses.
+
+Scale-to-zero hosting starts a new process for the request that wakes the
+app, so this is latency a user waits through. Each run launches a new
+Python process on an empty database, which imports the app and serves
+GET / (no storage) and then GET /note/<unknown id> (the first request that
+touches storage) through the WSGI test client, timing each step. With
+--gunicorn, each run starts gunicorn instead (one worker, the repository's
+gunicorn.conf.py) and times until those pages answer over HTTP.
+
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --runs 10 --budget-ms 500
+    python benchmarks/bench_cold_start.py --gunicorn --budget-ms 2000
+    python benchmarks/bench_cold_start.py --template-cache    # TEMPLATE_CACHE_DIR shared by the runs
+
+Exits non-zero when the median time from launch to the second response is
+over the budget (--budget-ms, or COLD_START_BUDGET_MS; default 1000), so it
+can gate a deploy.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = 1000
+MISSING_NOTE = '/note/coldstartprobe'
+
+# Runs in the child; times are absolute so the parent can add launch time
+CHILD = '''
+import json, time
+started = time.time()
+import app
+imported = time.time()
+client = app.app.test_client()
+index = client.get('/').status_code
+first = time.time()
+note = client.get(%r).status_code
+second = time.time()
+print(json.dumps({'started': started, 'imported': imported, 'first': first, 'second': second,
+                  'status': [index, note]}))
+''' % MISSING_NOTE
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_inprocess(env):
+    launched = time.time()
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    times = json.loads(out.strip().splitlines()[-1])
+    return {
+        'interpreter_ms': (times['started'] - launched) * 1000,
+        'import_ms': (times['imported'] - times['started']) * 1000,
+        'first_response_ms': (times['first'] - launched) * 1000,
+        'storage_response_ms': (times['second'] - launched) * 1000,
+        'status': times['status'],
+    }
+
+
+def _get(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def run_gunicorn(env, timeout=30):
+    port = free_port()
+    env = dict(env, WEB_CONCURRENCY='1', GUNICORN_BIND=f'127.0.0.1:{port}')
+    launched = time.time()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.time() - launched > timeout or server.poll() is not None:
+                raise RuntimeError('gunicorn did not answer')
+            try:
+                index = _get(port, '/')
+                break
+            except OSError:
+                time.sleep(0.005)
+        first = time.time()
+        note = _get(port, MISSING_NOTE)
+        second = time.time()
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'first_response_ms': (first - launched) * 1000,
+        'storage_response_ms': (second - launched) * 1000,
+        'status': [index, note],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--gunicorn', action='store_true', help='time a gunicorn server instead of the test client')
+    parser.add_argument('--template-cache', action='store_true',
+                        help='share one TEMPLATE_CACHE_DIR between runs, as a warmed image would')
+    parser.add_argument('--budget-ms', type=float,
+                        default=float(os.environ.get('COLD_START_BUDGET_MS', DEFAULT_BUDGET_MS)))
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(args.runs):
+            env = {name: value for name, value in os.environ.items()
+                   if name not in ('STORAGE_URL', 'METRICS_DIR', 'PROFILE_DIR', 'TEMPLATE_CACHE_DIR')}
+            env['DATABASE_PATH'] = os.path.join(tmp, f'cold-{run}.db')
+            env['PYTHONUNBUFFERED'] = '1'
+            if args.template_cache:
+                env['TEMPLATE_CACHE_DIR'] = os.path.join(tmp, 'templates')
+            row = run_gunicorn(env) if args.gunicorn else run_inprocess(env)
+            if row['status'] != [200, 200]:
+                raise SystemExit(f'unexpected status codes {row["status"]}')
+            rows.append(row)
+            print('  '.join(f'{name} {value:7.1f}' for name, value in row.items() if name.endswith('_ms')))
+
+    summary = {name: round(statistics.median(row[name] for row in rows), 1)
+               for name in rows[0] if name.endswith('_ms')}
+    verdict = 'ok' if summary['storage_response_ms'] <= args.budget_ms else 'OVER BUDGET'
+    print(f"median: {json.dumps(summary)}")
+    print(f"cold start {summary['storage_response_ms']} ms, budget {args.budget_ms:g} ms: {verdict}")
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'mode': 'gunicorn' if args.gunicorn else 'inprocess', 'budget_ms': args.budget_ms,
+                       'median': summary, 'runs': rows}, fh, indent=2)
+    return 0 if verdict == 'ok' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Compression ratio and CPU cost per note size bucket.
+
+Synthetic mode compresses typical payloads (log output, config files and
+already-random secrets) at a range of sizes with every available codec.
+Database mode reports what compression is actually saving in a notes.db.
+
+    python benchmarks/bench_compression.py
+    python benchmarks/bench_compression.py --database notes.db
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compression import RAW, ZLIB, ZSTD, Codec, zstandard  # noqa: E402
+
+SIZES = [512, 1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+
+
+def sample_log(size, rng):
+    lines = []
+    while sum(map(len, lines)) < size:
+        lines.append(f'2025-06-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z '
+                     f'{rng.choice(["INFO", "WARN", "ERROR"])} worker-{rng.randint(1, 8)} '
+                     f'GET /api/v1/items/{rng.randint(1, 99999)} {rng.choice([200, 200, 404, 500])} '
+                     f'{rng.randint(1, 900)}ms\n')
+    return ''.join(lines)[:size]
+
+
+def sample_config(size, rng):
+    lines = []
+    while sum(map(len, lines)) < size:
+        section = rng.choice(['database', 'cache', 'queue', 'auth', 'logging'])
+        lines.append(f'[{section}.{rng.randint(1, 50)}]\nhost = {section}-{rng.randint(1, 9)}.internal\n'
+                     f'port = {rng.randint(1000, 9999)}\ntimeout = {rng.randint(1, 60)}\nenabled = true\n\n')
+    return ''.join(lines)[:size]
+
+
+def sample_secret(size, rng):
+    return base64.b64encode(rng.randbytes(size))[:size].decode()
+
+
+SAMPLES = {'log': sample_log, 'config': sample_config, 'secret': sample_secret}
+
+
+def codecs():
+    result = [('zlib-1', Codec(ZLIB, threshold=0, level=1)),
+              ('zlib-6', Codec(ZLIB, threshold=0, level=6)),
+              ('zlib-9', Codec(ZLIB, threshold=0, level=9))]
+    if zstandard is not None:
+        result += [('zstd-3', Codec(ZSTD, threshold=0, level=3)),
+                   ('zstd-9', Codec(ZSTD, threshold=0, level=9))]
+    return result
+
+
+def time_call(func, arg, budget=0.2):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        func(arg)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            return elapsed / runs
+
+
+def synthetic(seed):
+    rng = random.Random(seed)
+    rows = []
+    for kind, make in SAMPLES.items():
+        for size in SIZES:
+            content = make(size, rng)
+            raw = len(content.encode())
+            for name, codec in codecs():
+                packed = codec.compress(content.encode())
+                rows.append({
+                    'sample': kind,
+                    'size': size,
+                    'codec': name,
+                    'ratio': round(raw / len(packed), 2),
+                    'compress_us': round(time_call(codec._compress, content.encode()) * 1e6, 1),
+                    'decompress_us': round(time_call(lambda value: codec.decode(value, codec.method),
+                                                     packed) * 1e6, 1),
+                })
+    return rows
+
+
+def bucket(size):
+    for limit in SIZES:
+        if size <= limit:
+            return limit
+    return SIZES[-1] * 4
+
+
+def from_database(path):
+    codec = Codec()
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    buckets = {}
+    for value, encoding in conn.execute('SELECT content, encoding FROM notes'):
+        stored = len(value.encode() if isinstance(value, str) else value)
+        original = len(codec.decode(value, encoding).encode()) if encoding is not RAW else stored
+        entry = buckets.setdefault(bucket(original), {'notes': 0, 'compressed': 0,
+                                                      'original_bytes': 0, 'stored_bytes': 0})
+        entry['notes'] += 1
+        entry['compressed'] += encoding is not RAW
+        entry['original_bytes'] += original
+        entry['stored_bytes'] += stored
+    rows = []
+    for size in sorted(buckets):
+        entry = buckets[size]
+        entry['ratio'] = round(entry['original_bytes'] / max(entry['stored_bytes'], 1), 2)
+        rows.append(dict(bucket=f'<={size}', **entry))
+    return rows
+
+
+def print_table(rows):
+    if not rows:
+        print('no notes')
+        return
+    columns = list(rows[0])
+    print('  '.join(f'{column:>14}' for column in columns))
+    for row in rows:
+        print('  '.join(f'{row[column]!s:>14}' for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure note compression.')
+    parser.add_argument('--database', help='report on the rows stored in this SQLite file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    rows = from_database(args.database) if args.database else synthetic(args.seed)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Microbenchmark for note id generation.
+
+Compares the original one-secrets.choice-per-character generator with the
+current single-draw implementation for a few lengths and alphabets.
+
+    python benchmarks/bench_ids.py --number 200000
+"""
+import argparse
+import json
+import os
+import secrets
+import string
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from notes import ALPHABETS, generate_note_id  # noqa: E402
+
+
+# The implementation this replaces, kept for comparison
+def legacy_generate_note_id(length=12):
+    characters = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(characters) for _ in range(length))
+
+
+def measure(func, number, repeat=5):
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    return number / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark note id generation.')
+    parser.add_argument('--number', type=int, default=100000, help='ids per timing run')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    cases = [
+        ('legacy base62', 12, lambda: legacy_generate_note_id(12)),
+        ('base62', 12, lambda: generate_note_id(12, ALPHABETS['base62'])),
+        ('base64url', 12, lambda: generate_note_id(12, ALPHABETS['base64url'])),
+        ('legacy base62', 22, lambda: legacy_generate_note_id(22)),
+        ('base62', 22, lambda: generate_note_id(22, ALPHABETS['base62'])),
+        ('base64url', 22, lambda: generate_note_id(22, ALPHABETS['base64url'])),
+    ]
+    results = []
+    for name, length, func in cases:
+        rate = measure(func, args.number)
+        results.append({'generator': name, 'length': length, 'ids_per_s': round(rate)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = {r['length']: r['ids_per_s'] for r in results if r['generator'].startswith('legacy')}
+    for result in results:
+        speedup = result['ids_per_s'] / baseline[result['length']]
+        print(f"{result['generator']:<15} len={result['length']:<3} "
+              f"{result['ids_per_s']:>10,} ids/s  x{speedup:.1f}")
+
+
+if __name__ == '__main__':
+    main()
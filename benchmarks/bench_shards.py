@@ -0,0 +1,102 @@
+"""Write throughput against the number of SQLite shards.
+
+Several processes (standing in for gunicorn workers) each create a single
+view note and read it back (a second write: the view that deletes it) as
+fast as they can. Every shard has its own write lock, so with more shards
+fewer of those commits wait on each other.
+
+    python benchmarks/bench_shards.py --processes 8 --shards 1 2 4 8
+    python benchmarks/bench_shards.py --synchronous FULL    # fsync every commit
+
+Throughput only grows with shards while there are cores (or, with FULL,
+disk queue depth) to run the writers in parallel.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+from notes import generate_note_id  # noqa: E402
+from storage import NOTE_LAST_VIEW, ShardedStorage, SQLiteStorage  # noqa: E402
+from storage.sharded import shard_paths  # noqa: E402
+
+
+def open_store(path, shards, synchronous):
+    pragmas = tuple((name, synchronous if name == 'synchronous' else value)
+                    for name, value in db.DEFAULT_PRAGMAS)
+    return ShardedStorage(SQLiteStorage(db.ConnectionPool(shard_path, pragmas))
+                          for shard_path in shard_paths(path, shards))
+
+
+def worker(path, shards, synchronous, start_at, stop_at, results):
+    store = open_store(path, shards, synchronous)
+    body = 'x' * 200
+    cycles = errors = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while time.time() < stop_at:
+        note_id = generate_note_id()
+        store.create(note_id, body, max_views=1)
+        if store.consume_view(note_id)[0] != NOTE_LAST_VIEW:
+            errors += 1
+        cycles += 1
+    store.close()
+    results.put((cycles, errors))
+
+
+def run(path, shards, processes, duration, synchronous):
+    store = open_store(path, shards, synchronous)
+    store.init_schema()
+    store.close()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    start_at = time.time() + 0.5
+    stop_at = start_at + duration
+    children = [context.Process(target=worker, args=(path, shards, synchronous, start_at, stop_at, results))
+                for _ in range(processes)]
+    for child in children:
+        child.start()
+    totals = [results.get() for _ in children]
+    for child in children:
+        child.join()
+    cycles = sum(cycles for cycles, _ in totals)
+    return {
+        'shards': shards,
+        'processes': processes,
+        'cycles_per_second': round(cycles / duration, 1),
+        # each cycle commits twice: the insert and the deleting view
+        'commits_per_second': round(2 * cycles / duration, 1),
+        'errors': sum(errors for _, errors in totals),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--processes', type=int, default=max(4, os.cpu_count() or 1))
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'])
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    rows = []
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as tmp:
+            row = run(os.path.join(tmp, 'notes.db'), shards, args.processes, args.duration, args.synchronous)
+        rows.append(row)
+        print(f"{row['shards']:>3} shards  {row['cycles_per_second']:>9} create+view/s  "
+              f"{row['commits_per_second']:>9} commits/s  errors={row['errors']}")
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'cpus': os.cpu_count(), 'synchronous': args.synchronous, 'results': rows}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Contract check for the storage engines.
+
+Runs the same scenarios against the in-memory, SQLite (plain, with view
+leases, the note cache, shards or shared bodies) and Redis engines (the
+latter against the stand-in server from standin_redis.py unless --redis-url
+points at a real one) and exits non-zero if any engine misbehaves.
+
+    python benchmarks/check_storage.py
+    python benchmarks/check_storage.py --redis-url redis://localhost:6379/15
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+from benchmarks.standin_redis import StandinRedis  # noqa: E402
+from cache import NoteCache  # noqa: E402
+from storage import (NOTE_EXPIRED, NOTE_LAST_VIEW, NOTE_MISSING, NOTE_VIEWED,  # noqa: E402
+                     NoteExists, SQLiteStorage, create_storage)
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def scenario_views(store):
+    store.create('views', 'body', max_views=3)
+    results = [store.consume_view('views') for _ in range(4)]
+    check([status for status, _ in results[:3]] == [NOTE_VIEWED, NOTE_VIEWED, NOTE_LAST_VIEW],
+          f'unexpected view sequence {results}')
+    check(results[0][1] == 'body', 'content not returned')
+    check(results[3][0] != NOTE_VIEWED and results[3][1] is None, 'note shown after last view')
+
+
+def scenario_duplicate(store):
+    store.create('dup', 'one')
+    try:
+        store.create('dup', 'two')
+    except NoteExists:
+        pass
+    else:
+        raise AssertionError('duplicate id accepted')
+    check(store.consume_view('dup') == (NOTE_VIEWED, 'one'), 'duplicate create overwrote note')
+
+
+def scenario_time_expiry(store):
+    store.create('soon', 'body', expires_at=time.time() + 0.2)
+    check(store.consume_view('soon')[0] == NOTE_VIEWED, 'fresh note not viewable')
+    time.sleep(0.4)
+    check(store.consume_view('soon')[1] is None, 'note shown after expiry')
+
+
+def scenario_delete(store):
+    store.create('gone', 'body')
+    store.delete('gone')
+    check(store.consume_view('gone') == (NOTE_MISSING, None), 'deleted note still viewable')
+
+
+def scenario_sweep(store):
+    store.create('stale', 'body', expires_at=time.time() + 0.05)
+    store.create('fresh', 'body', expires_at=time.time() + 3600)
+    time.sleep(0.1)
+    store.sweep_expired()
+    check(store.consume_view('fresh')[0] == NOTE_VIEWED, 'sweep removed a live note')
+    check(store.consume_view('stale')[1] is None, 'expired note survived sweep')
+
+
+def scenario_concurrent_views(store, threads=32):
+    for max_views in (1, 5, 10):
+        note_id = f'race{max_views}'
+        store.create(note_id, 'body', max_views=max_views)
+        shown = []
+        barrier = threading.Barrier(threads)
+
+        def reader():
+            barrier.wait()
+            if store.consume_view(note_id)[1] is not None:
+                shown.append(1)
+
+        workers = [threading.Thread(target=reader) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        check(len(shown) == max_views, f'{max_views}-view note shown {len(shown)} times')
+
+
+# Only notes actually deleted by a view are reported, each once and with why.
+# Redis expires keys itself, so it has no time removals to report.
+def scenario_removal_reports(store):
+    reports = []
+    store.report_removals(lambda reason, trigger: reports.append((reason, trigger)))
+    try:
+        store.create('once', 'body', max_views=1)
+        store.consume_view('once')
+        store.consume_view('once')
+        check(reports == [('views', 'view')], f'last view reported as {reports}')
+        del reports[:]
+        store.create('brief', 'body', expires_at=time.time() + 0.05)
+        time.sleep(0.1)
+        store.consume_view('brief')
+        store.consume_view('brief')
+        check(reports in ([], [('time', 'view')]), f'expiry reported as {reports}')
+    finally:
+        store.report_removals(None)
+
+
+# SQLite rows written before expires_at held Unix time keep naive local ISO
+# text until the sweeper converts them. Views of them (through the note cache
+# or a lease too) must still work and still honour the expiry.
+def scenario_legacy_expiry(store):
+    def set_expiry(note_id, value):
+        engine = store.shard_for(note_id) if hasattr(store, 'shard_for') else store
+        with db.pooled(engine.pool) as conn, db.transaction(conn):
+            conn.execute('UPDATE notes SET expires_at = ? WHERE id = ?', (value, note_id))
+
+    if not hasattr(store, 'pool') and not hasattr(store, 'shard_for'):
+        return
+    store.create('legacy', 'body', max_views=3)
+    set_expiry('legacy', str(datetime.now() + timedelta(hours=1)))
+    statuses = [store.consume_view('legacy')[0] for _ in range(3)]
+    check(statuses == [NOTE_VIEWED, NOTE_VIEWED, NOTE_LAST_VIEW], f'old-format expiry viewed as {statuses}')
+    store.create('legacy-past', 'body')
+    set_expiry('legacy-past', str(datetime.now() - timedelta(hours=1)))
+    check(store.consume_view('legacy-past') == (NOTE_EXPIRED, None), 'old-format expiry in the past not honoured')
+
+
+SCENARIOS = [scenario_views, scenario_duplicate, scenario_time_expiry,
+             scenario_delete, scenario_sweep, scenario_concurrent_views,
+             scenario_removal_reports, scenario_legacy_expiry]
+
+
+def run_engine(name, store):
+    store.init_schema()
+    failures = 0
+    for scenario in SCENARIOS:
+        try:
+            scenario(store)
+        except AssertionError as exc:
+            failures += 1
+            print(f'FAIL {name} {scenario.__name__}: {exc}')
+    print(f'{name}: {len(SCENARIOS) - failures}/{len(SCENARIOS)} scenarios passed')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check storage engine behaviour.')
+    parser.add_argument('--redis-url', help='use a real Redis instead of the stand-in (data is flushed)')
+    args = parser.parse_args()
+
+    standin = None
+    redis_url = args.redis_url
+    if not redis_url:
+        standin = StandinRedis().start()
+        redis_url = standin.url
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        engines = [
+            ('memory', create_storage('memory://')),
+            ('sqlite', create_storage('sqlite:///' + os.path.join(tmp, 'check.db'))),
+            ('redis', create_storage(redis_url)),
+            ('sqlite+leases', SQLiteStorage.from_path(os.path.join(tmp, 'leased.db'), lease_size=4)),
+            ('sqlite+cache', SQLiteStorage.from_path(os.path.join(tmp, 'cached.db'), cache=NoteCache())),
+            ('sqlite+shards', create_storage('sqlite:///' + os.path.join(tmp, 'sharded.db') + '?shards=4')),
+            # every body shared, so views and deletes keep moving reference counts
+            ('sqlite+dedup', SQLiteStorage.from_path(os.path.join(tmp, 'dedup.db'), dedup_min_size=1)),
+        ]
+        engines[2][1].client.execute('FLUSHDB')
+        for name, store in engines:
+            try:
+                failures += run_engine(name, store)
+            finally:
+                store.close()
+
+    if standin:
+        standin.stop()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""Load test for the create/view/expire paths.
+
+Drives mixed workloads either in-process through the Flask test client (the
+default, against a scratch database) or over HTTP against a running server,
+and writes throughput, latency percentiles and error counts as JSON so runs
+from different branches can be compared.
+
+    python benchmarks/loadtest.py --threads 8 --duration 5 --output before.json
+    python benchmarks/loadtest.py --url http://localhost:5000 --workload read_multi
+    python benchmarks/loadtest.py --compare before.json after.json
+
+Workloads:
+    create        form POST /create with small bodies and random expiry
+    read_multi    90% views of 10-view notes, 10% creates to keep the pool full
+    burst_1view   every thread opens a batch of fresh 1-view notes at once
+    large         create and view 1 MiB notes
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EXPIRATION_TYPES = ['1_view', '5_views', '10_views', '10_minutes', '1_hour', '24_hours']
+SMALL_BODY = 'x' * 256
+LARGE_BODY = 'y' * (1024 * 1024)
+
+
+# Thin wrappers so workloads don't care whether they talk HTTP or WSGI.
+# Each returns (status, location header).
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+        self.lock_errors = 0
+        self._local = threading.local()
+        from flask import got_request_exception
+        got_request_exception.connect(self._on_exception, app)
+
+    def _on_exception(self, sender, exception, **extra):
+        if isinstance(exception, sqlite3.OperationalError) and 'locked' in str(exception):
+            self.lock_errors += 1
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def get(self, path):
+        response = self._client().get(path)
+        response.close()
+        return response.status_code, response.headers.get('Location')
+
+    def post(self, path, form):
+        response = self._client().post(path, data=form)
+        response.close()
+        return response.status_code, response.headers.get('Location')
+
+
+class HttpDriver:
+    # Over HTTP a lock error just shows up as a 500
+    lock_errors = 0
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self._local = threading.local()
+
+    def _request(self, method, path, body=None, headers=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        return response.status, response.getheader('Location')
+
+    def get(self, path):
+        return self._request('GET', path)
+
+    def post(self, path, form):
+        return self._request('POST', path, urlencode(form),
+                             {'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+def note_id_from(location):
+    return location.rsplit('/', 1)[1] if location else None
+
+
+# Shared per-workload recorder
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def timed(self, op, call, *args):
+        start = time.perf_counter()
+        try:
+            status, location = call(*args)
+        except (OSError, http.client.HTTPException):
+            status, location = 599, None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.setdefault(op, []).append(elapsed)
+            if status >= 500:
+                self.errors += 1
+        return status, location
+
+
+def create(driver, recorder, body, expiration_type):
+    status, location = recorder.timed('create', driver.post, '/create',
+                                      {'content': body, 'expiration_type': expiration_type})
+    return note_id_from(location) if status == 302 else None
+
+
+def view(driver, recorder, note_id):
+    return recorder.timed('view', driver.get, '/note/' + note_id)[0]
+
+
+def workload_create(driver, recorder, deadline, shared, rng):
+    while time.perf_counter() < deadline:
+        create(driver, recorder, SMALL_BODY, rng.choice(EXPIRATION_TYPES))
+
+
+def workload_read_multi(driver, recorder, deadline, shared, rng):
+    pool, lock = shared['pool'], shared['lock']
+    while time.perf_counter() < deadline:
+        with lock:
+            note_id = rng.choice(pool) if pool and rng.random() >= 0.1 else None
+        if note_id is None:
+            note_id = create(driver, recorder, SMALL_BODY, '10_views')
+            if note_id:
+                with lock:
+                    pool.append(note_id)
+            continue
+        view(driver, recorder, note_id)
+        with lock:
+            shared['views'][note_id] = shared['views'].get(note_id, 0) + 1
+            if shared['views'][note_id] >= 10 and note_id in pool:
+                pool.remove(note_id)
+
+
+# Threads move in lockstep: all create a batch, then all read theirs at once.
+# The barrier action decides for everyone whether another round starts.
+def workload_burst_1view(driver, recorder, deadline, shared, rng):
+    while not shared['stop']:
+        batch = [create(driver, recorder, SMALL_BODY, '1_view') for _ in range(20)]
+        shared['barrier'].wait()
+        for note_id in batch:
+            if note_id:
+                view(driver, recorder, note_id)
+        shared['barrier'].wait()
+
+
+def workload_large(driver, recorder, deadline, shared, rng):
+    while time.perf_counter() < deadline:
+        note_id = create(driver, recorder, LARGE_BODY, '5_views')
+        if note_id:
+            view(driver, recorder, note_id)
+
+
+WORKLOADS = {
+    'create': workload_create,
+    'read_multi': workload_read_multi,
+    'burst_1view': workload_burst_1view,
+    'large': workload_large,
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+
+    def as_ms(seconds):
+        return round(seconds * 1000, 3) if seconds is not None else None
+
+    return {
+        'count': len(values),
+        'mean_ms': as_ms(sum(values) / len(values)) if values else None,
+        'p50_ms': as_ms(percentile(values, 0.50)),
+        'p95_ms': as_ms(percentile(values, 0.95)),
+        'p99_ms': as_ms(percentile(values, 0.99)),
+        'max_ms': as_ms(values[-1] if values else None),
+    }
+
+
+def run_workload(name, driver, threads, duration, seed=0):
+    recorder = Recorder()
+    start = time.perf_counter()
+    deadline = start + duration
+    shared = {'pool': [], 'views': {}, 'lock': threading.Lock(), 'stop': False}
+    shared['barrier'] = threading.Barrier(
+        threads, action=lambda: shared.update(stop=time.perf_counter() >= deadline))
+    lock_errors_before = driver.lock_errors
+
+    workers = [threading.Thread(target=WORKLOADS[name],
+                                args=(driver, recorder, deadline, shared, random.Random(seed * 1000 + i)))
+               for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total_ops = sum(len(values) for values in recorder.latencies.values())
+    return {
+        'threads': threads,
+        'elapsed_s': round(elapsed, 3),
+        'ops': total_ops,
+        'throughput_ops_s': round(total_ops / elapsed, 1),
+        'errors': recorder.errors,
+        'lock_errors': driver.lock_errors - lock_errors_before,
+        'latency': {op: summarize(values) for op, values in recorder.latencies.items()},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_driver(args, tmp):
+    if args.url:
+        return HttpDriver(args.url)
+    os.environ['DATABASE_PATH'] = os.path.join(tmp, 'loadtest.db')
+    import app as app_module
+    app_module.init_db()
+    return TestClientDriver(app_module.app)
+
+
+def compare(before_path, after_path):
+    with open(before_path) as fh:
+        before = json.load(fh)
+    with open(after_path) as fh:
+        after = json.load(fh)
+    print(f"{'workload':<14}{'op':<8}{'ops/s':>20}{'p50 ms':>20}{'p99 ms':>20}")
+    for name, result in after['workloads'].items():
+        base = before['workloads'].get(name)
+        if not base:
+            continue
+        for op, stats in result['latency'].items():
+            old = base['latency'].get(op, {})
+            print(f"{name:<14}{op:<8}"
+                  f"{base['throughput_ops_s']:>9} -> {result['throughput_ops_s']:<8}"
+                  f"{old.get('p50_ms')!s:>9} -> {stats['p50_ms']!s:<8}"
+                  f"{old.get('p99_ms')!s:>9} -> {stats['p99_ms']!s:<8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test EphemeralBin.')
+    parser.add_argument('--url', help='target a running server instead of the in-process test client')
+    parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS),
+                        help='workload to run (repeatable, default: all)')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5, help='seconds per workload')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='print a comparison of two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        driver = make_driver(args, tmp)
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'target': args.url or 'flask-test-client',
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'threads': args.threads,
+                'duration_s': args.duration,
+                'seed': args.seed,
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'workloads': {},
+        }
+        for name in args.workload or list(WORKLOADS):
+            results['workloads'][name] = run_workload(name, driver, args.threads, args.duration, args.seed)
+            print(f"{name}: {results['workloads'][name]['throughput_ops_s']} ops/s", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Tiny in-process stand-in for a Redis server.
+
+Implements just the commands the storage engines use (strings, counters and
+key expiry) over real RESP on a TCP socket, so RedisStorage can be exercised
+offline. Not for production use.
+
+    python benchmarks/standin_redis.py --port 6399
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _Error(Exception):
+    pass
+
+
+class Keyspace:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _set_ttl_ms(self, key, ms):
+        self.expires[key] = time.monotonic() + ms / 1000
+
+    def _incr(self, key, delta):
+        current = int(self.data[key]) if self._alive(key) else 0
+        current += delta
+        self.data[key] = str(current).encode()
+        return current
+
+    def execute(self, name, args):
+        with self.lock:
+            handler = getattr(self, 'cmd_' + name.lower(), None)
+            if handler is None:
+                raise _Error(f"ERR unknown command '{name}'")
+            return handler(*args)
+
+    def cmd_ping(self, *args):
+        return 'PONG'
+
+    def cmd_select(self, index):
+        return 'OK'
+
+    def cmd_auth(self, *args):
+        return 'OK'
+
+    def cmd_flushdb(self):
+        self.data.clear()
+        self.expires.clear()
+        return 'OK'
+
+    def cmd_dbsize(self):
+        return sum(1 for key in list(self.data) if self._alive(key))
+
+    def cmd_get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    def cmd_set(self, key, value, *options):
+        options = [option.upper() if isinstance(option, bytes) else option for option in options]
+        ttl_ms = None
+        nx = xx = False
+        i = 0
+        while i < len(options):
+            option = options[i]
+            if option in (b'EX', b'PX'):
+                ttl_ms = int(options[i + 1]) * (1000 if option == b'EX' else 1)
+                i += 1
+            elif option == b'NX':
+                nx = True
+            elif option == b'XX':
+                xx = True
+            else:
+                raise _Error('ERR syntax error')
+            i += 1
+        exists = self._alive(key)
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if ttl_ms is not None:
+            self._set_ttl_ms(key, ttl_ms)
+        return 'OK'
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                removed += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    cmd_unlink = cmd_del
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def cmd_incr(self, key):
+        return self._incr(key, 1)
+
+    def cmd_decr(self, key):
+        return self._incr(key, -1)
+
+    def cmd_incrby(self, key, delta):
+        return self._incr(key, int(delta))
+
+    def cmd_decrby(self, key, delta):
+        return self._incr(key, -int(delta))
+
+    def cmd_expire(self, key, seconds):
+        return self.cmd_pexpire(key, int(seconds) * 1000)
+
+    def cmd_pexpire(self, key, ms):
+        if not self._alive(key):
+            return 0
+        self._set_ttl_ms(key, int(ms))
+        return 1
+
+    def cmd_pttl(self, key):
+        if not self._alive(key):
+            return -2
+        deadline = self.expires.get(key)
+        if deadline is None:
+            return -1
+        return int((deadline - time.monotonic()) * 1000)
+
+
+def encode_reply(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, _Error):
+        return b'-%s\r\n' % str(reply).encode()
+    if isinstance(reply, str):
+        return b'+%s\r\n' % reply.encode()
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(encode_reply(item) for item in reply)
+    return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            try:
+                reply = self.server.keyspace.execute(args[0].decode(), args[1:])
+            except _Error as exc:
+                reply = exc
+            except (TypeError, ValueError):
+                reply = _Error('ERR wrong number of arguments or value is not an integer')
+            self.wfile.write(encode_reply(reply))
+
+
+class StandinRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.keyspace = Keyspace()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'redis://{host}:{port}/0'
+
+    # Serve on a background thread and return self
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a stand-in Redis server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6399)
+    args = parser.parse_args()
+    server = StandinRedis(args.host, args.port)
+    print(f'stand-in redis listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Concurrency stress check for view consumption.
+
+Creates view-limited notes in a scratch database and hammers each one from
+many threads at once, then checks that every note was shown exactly
+max_views times - never more, never fewer.
+
+With --processes the readers are spread over forked worker processes. With
+--lease-size views are served from leased slots (VIEW_LEASE_SIZE). Readers
+outnumber views, but slots still leased when the hammer ends aren't shown
+yet: once it is over the leases are left to pass VIEW_LEASE_TTL and are
+flushed, and the note is fetched again until it is gone. Views shown then
+count too, so the total must still be exactly max_views.
+
+Every run also replays one interleaving of two leasing processes on a
+10-view note, in which the lease handed back last is not the one that took
+the note to max_views: the note must still be gone once both are back.
+
+    python benchmarks/stress_views.py --threads 32 --rounds 20
+    python benchmarks/stress_views.py --processes 4 --lease-size 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EXPIRATION_TYPES = {'1_view': 1, '5_views': 5, '10_views': 10}
+
+
+def load_app(db_path, lease_size=0, lease_ttl=1.0):
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['VIEW_LEASE_SIZE'] = str(lease_size)
+    os.environ['VIEW_LEASE_TTL'] = str(lease_ttl)
+    import app as app_module
+    app_module.init_db()
+    return app_module.app
+
+
+def create_note(client, expiration_type):
+    response = client.post('/create', data={'content': 'stress', 'expiration_type': expiration_type})
+    return response.headers['Location'].rsplit('/', 1)[1]
+
+
+def hammer(app, note_id, threads, barrier=None):
+    shown = []
+    barrier = barrier or threading.Barrier(threads)
+
+    def reader():
+        client = app.test_client()
+        barrier.wait()
+        body = client.get('/note/' + note_id).get_data(as_text=True)
+        if 'note-content' in body:
+            shown.append(1)
+
+    workers = [threading.Thread(target=reader) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(shown)
+
+
+# Same as hammer, with the readers split over forked processes. Each child
+# hands back its unused leased views before exiting.
+def hammer_processes(app, note_id, threads, processes):
+    import app as app_module
+    context = multiprocessing.get_context('fork')
+    per_process = max(1, threads // processes)
+    barrier = context.Barrier(per_process * processes)
+    results = context.Queue()
+
+    def child():
+        results.put(hammer(app, note_id, per_process, barrier))
+        app.extensions['storage'].close()
+
+    app_module.before_fork(app)
+    children = [context.Process(target=child) for _ in range(processes)]
+    for process in children:
+        process.start()
+    shown = sum(results.get() for _ in children)
+    for process in children:
+        process.join()
+    return shown
+
+
+def shown_once(client, note_id):
+    return 'note-content' in client.get('/note/' + note_id).get_data(as_text=True)
+
+
+# Views left over after the hammer: let the leases lapse and hand them back,
+# then read the note until it is gone
+def drain(app, note_id, max_views):
+    time.sleep(app.config['VIEW_LEASE_TTL'])
+    app.extensions['storage'].flush_leases(everything=True)
+    client = app.test_client()
+    shown = 0
+    while shown <= max_views and shown_once(client, note_id):
+        shown += 1
+    return shown
+
+
+# Two engines on one database stand in for two worker processes: A leases
+# views 1-4, B leases 5-8, A takes the final lease (9-10) and shows it, and
+# only then does B show its views and hand its lease back
+def interleaved(db_path):
+    from storage import NOTE_LAST_VIEW, NOTE_VIEWED, SQLiteStorage
+    a, b = (SQLiteStorage.from_path(db_path, lease_size=4, lease_ttl=60) for _ in range(2))
+    a.init_schema()
+    a.create('interleaved', 'stress', max_views=10)
+    statuses = [a.consume_view('interleaved')[0] for _ in range(4)]
+    statuses.append(b.consume_view('interleaved')[0])
+    statuses += [a.consume_view('interleaved')[0] for _ in range(2)]
+    statuses += [b.consume_view('interleaved')[0] for _ in range(3)]
+    b.flush_leases(everything=True)
+    left = a.count()
+    a.close()
+    b.close()
+    shown = sum(status in (NOTE_VIEWED, NOTE_LAST_VIEW) for status in statuses)
+    return shown == 10 and left == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--lease-size', type=int, default=0)
+    parser.add_argument('--lease-ttl', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(os.path.join(tmp, 'stress.db'), args.lease_size, args.lease_ttl)
+        client = app.test_client()
+        failures = 0
+        late = 0
+        for expiration_type, max_views in EXPIRATION_TYPES.items():
+            for _ in range(args.rounds):
+                note_id = create_note(client, expiration_type)
+                if args.processes > 1:
+                    shown = hammer_processes(app, note_id, args.threads, args.processes)
+                else:
+                    shown = hammer(app, note_id, args.threads)
+                after = drain(app, note_id, max_views)
+                if shown + after != max_views:
+                    failures += 1
+                    print(f'FAIL {expiration_type} {note_id}: shown {shown} + {after} times')
+                elif after:
+                    late += 1
+            print(f'{expiration_type}: {args.rounds} notes x {args.threads} readers checked')
+        if not interleaved(os.path.join(tmp, 'interleaved.db')):
+            failures += 1
+            print('FAIL interleaved leases: note shown the wrong number of times or left behind')
+
+    if late:
+        print(f'{late} notes had views left on lease when the hammer ended')
+    if failures:
+        print(f'{failures} notes shown the wrong number of times')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
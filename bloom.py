@@ -0,0 +1,318 @@
+"""Negative-lookup filter of live note ids.
+
+A Bloom filter that answers "this id definitely does not exist" without
+touching the database, so random probes and stale links skip SQLite entirely.
+
+The filter lives in a memory-mapped file next to the database so every
+worker process on the host shares it: a note created by one worker is
+immediately visible to the others. Each slot is a whole byte rather than a
+bit, so concurrent writers in different processes never lose each other's
+updates to a read-modify-write of a shared byte.
+
+Bloom filters can't forget, so deleted notes only ever raise the
+false-positive rate (a false positive just means a normal database lookup).
+The filter is rebuilt from the database periodically, by a thread in every
+process (only one of them does the work each interval). A rebuild writes a
+new generation next to the live file; writers that see the "rebuilding" flag
+add to both, and everyone moves to the new file once the old one is marked
+retired.
+
+The header keeps a watermark of the database the filter was built from. If
+the database has moved on when storage is prepared (notes were created by a
+process running without the filter, or the database was restored), the
+filter is rebuilt before the first lookup rather than reporting those notes
+as missing.
+
+    python bloom.py stats --database notes.db
+    python bloom.py rebuild --database notes.db
+"""
+import argparse
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import threads
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EBBLOOM1'
+# magic, generation, slots, hashes, built_at, rebuilding, retired
+HEADER = struct.Struct('<8sQQIdBB')
+HEADER_SIZE = 64
+REBUILDING_OFFSET = HEADER.size - 2
+RETIRED_OFFSET = HEADER.size - 1
+# Highest rowid and row count the filter was built from, after the header
+# fields; files from before it was kept read as zeros
+WATERMARK = struct.Struct('<QQ')
+WATERMARK_OFFSET = 40
+
+DEFAULT_CAPACITY = 1_000_000
+DEFAULT_ERROR_RATE = 0.01
+DEFAULT_REBUILD_INTERVAL = 3600
+
+
+def optimal_parameters(capacity, error_rate):
+    slots = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(slots / capacity * math.log(2)))
+    return slots, hashes
+
+
+# Double hashing: k positions from one 128-bit digest
+def positions(key, slots, hashes):
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % slots for i in range(hashes)]
+
+
+# One generation of the filter, mapped from its file
+class BloomFile:
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR)
+        try:
+            self.mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, self.generation, self.slots, self.hashes, self.built_at, _, _ = \
+            HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a note filter file')
+
+    @classmethod
+    def create(cls, path, slots, hashes, generation, watermark=(0, 0)):
+        with open(path, 'wb') as fh:
+            fh.write(HEADER.pack(MAGIC, generation, slots, hashes, time.time(), 0, 0))
+            fh.seek(WATERMARK_OFFSET)
+            fh.write(WATERMARK.pack(*watermark))
+            fh.truncate(HEADER_SIZE + slots)
+        return cls(path)
+
+    @property
+    def watermark(self):
+        return WATERMARK.unpack_from(self.mm, WATERMARK_OFFSET)
+
+    def add(self, key):
+        for position in positions(key, self.slots, self.hashes):
+            self.mm[HEADER_SIZE + position] = 1
+
+    def __contains__(self, key):
+        mm = self.mm
+        return all(mm[HEADER_SIZE + position] for position in positions(key, self.slots, self.hashes))
+
+    @property
+    def rebuilding(self):
+        return self.mm[REBUILDING_OFFSET] == 1
+
+    @property
+    def retired(self):
+        return self.mm[RETIRED_OFFSET] == 1
+
+    def mark_rebuilding(self):
+        self.mm[REBUILDING_OFFSET] = 1
+
+    def mark_retired(self):
+        self.mm[RETIRED_OFFSET] = 1
+
+    def stats(self):
+        filled = self.slots - self.mm[HEADER_SIZE:].count(0)
+        fill = filled / self.slots
+        estimated = -self.slots / self.hashes * math.log(1 - fill) if fill < 1 else float('inf')
+        return {
+            'generation': self.generation,
+            'slots': self.slots,
+            'hashes': self.hashes,
+            'memory_bytes': HEADER_SIZE + self.slots,
+            'fill_ratio': round(fill, 6),
+            'estimated_ids': round(estimated),
+            'false_positive_rate': round(fill ** self.hashes, 6),
+            'built_at': self.built_at,
+            'watermark': list(self.watermark),
+        }
+
+    def close(self):
+        self.mm.close()
+
+
+# Per-process handle that follows the shared filter across rebuilds
+class NegativeLookup:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._file = None
+        self._next = None
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.rejected = 0
+
+    @property
+    def next_path(self):
+        return self.path + '.next'
+
+    @contextmanager
+    def _exclusive(self):
+        with open(self.path + '.lock', 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _current(self):
+        current = self._file
+        if current is None or current.retired:
+            with self._lock:
+                if self._file is None or self._file.retired:
+                    if self._file is not None:
+                        self._file.close()
+                    self._file = BloomFile(self.path)
+                current = self._file
+        return current
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def watermark(self):
+        return self._current().watermark
+
+    def might_exist(self, note_id):
+        self.lookups += 1
+        if note_id in self._current():
+            return True
+        self.rejected += 1
+        return False
+
+    # Call after the note is committed: anybody who scans the database later
+    # sees it, and anybody who scanned earlier is told to look here too.
+    def add(self, note_id):
+        current = self._current()
+        current.add(note_id)
+        if current.rebuilding:
+            self._add_to_next(note_id)
+
+    def _add_to_next(self, note_id):
+        with self._lock:
+            if self._next is None or self._next.generation <= self._file.generation:
+                # Once the rebuild is done the next file has already been
+                # renamed onto the main path
+                path = self.next_path if os.path.exists(self.next_path) else self.path
+                if self._next is not None:
+                    self._next.close()
+                self._next = BloomFile(path)
+            target = self._next
+        target.add(note_id)
+
+    # Build a fresh generation sized for count from ids() (a callable yielding
+    # the live ids) unless another process rebuilt within min_age seconds.
+    # watermark is the database's, taken before ids() is read.
+    def rebuild(self, ids, count, min_age=0, watermark=(0, 0)):
+        with self._exclusive():
+            current = BloomFile(self.path) if self.exists() else None
+            try:
+                if current is not None and time.time() - current.built_at < min_age:
+                    return False
+                slots, hashes = optimal_parameters(max(self.capacity, 2 * count), self.error_rate)
+                generation = current.generation + 1 if current else 1
+                fresh = BloomFile.create(self.next_path, slots, hashes, generation, watermark)
+                if current is not None:
+                    current.mark_rebuilding()
+                for note_id in ids():
+                    fresh.add(note_id)
+                os.replace(self.next_path, self.path)
+                if current is not None:
+                    current.mark_retired()
+                fresh.close()
+            finally:
+                if current is not None:
+                    current.close()
+        return True
+
+    def stats(self):
+        return dict(self._current().stats(), lookups=self.lookups, rejected=self.rejected)
+
+    def close(self):
+        for handle in (self._file, self._next):
+            if handle is not None:
+                handle.close()
+        self._file = self._next = None
+
+
+# With NEGATIVE_FILTER set, put the filter in front of the SQLite engine.
+# Other engines are skipped: the filter file is only shared between processes
+# on one host, and Redis-backed notes can be created on any node.
+def init_app(app):
+    if not app.config.get('NEGATIVE_FILTER'):
+        return None
+    import storage
+    store = app.extensions['storage']
+    if not isinstance(store, (storage.SQLiteStorage, storage.ShardedStorage)):
+        logger.warning('negative lookup filter needs SQLite storage; disabled')
+        return None
+    lookup = NegativeLookup(app.config.get('NEGATIVE_FILTER_PATH') or app.config['DATABASE'] + '.bloom',
+                            int(app.config.get('NEGATIVE_FILTER_CAPACITY', DEFAULT_CAPACITY)),
+                            float(app.config.get('NEGATIVE_FILTER_ERROR_RATE', DEFAULT_ERROR_RATE)))
+    rebuild_interval = float(app.config.get('NEGATIVE_FILTER_REBUILD_INTERVAL', DEFAULT_REBUILD_INTERVAL))
+    filtered = storage.FilteredStorage(store, lookup, rebuild_interval)
+
+    # Build the filter when storage is first used if there is none yet (first
+    # start, a fresh disk) or the database has changed behind its back
+    def build_stale():
+        if not lookup.exists() or tuple(lookup.watermark()) != tuple(filtered.id_watermark()):
+            filtered.rebuild()
+        logger.info('negative lookup filter: %s', lookup.stats())
+
+    storage.on_prepare(app, build_stale)
+    app.extensions['storage'] = filtered
+    app.extensions['negative_lookup'] = lookup
+    app.extensions['negative_filter'] = filtered
+
+    @app.before_request
+    def start_refresher():
+        start(app)
+
+    return lookup
+
+
+# Periodic rebuild on a daemon thread for this process, whether or not the
+# sweeper runs; started on first call (see threads.start_once)
+def start(app):
+    filtered = app.extensions.get('negative_filter')
+    if filtered is None or filtered.rebuild_interval <= 0:
+        return None
+    interval = filtered.rebuild_interval
+    return threads.start_once(app.extensions, 'negative_filter_refresher', lambda: threads.PeriodicThread(
+        'note-filter-rebuild', interval, lambda: filtered.rebuild(min_age=interval)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or rebuild the note id filter.')
+    parser.add_argument('command', choices=['stats', 'rebuild'])
+    parser.add_argument('--database', default='notes.db')
+    parser.add_argument('--shards', type=int, default=1, help='number of database shards')
+    parser.add_argument('--filter', help='filter file (default: <database>.bloom)')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY)
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_ERROR_RATE)
+    args = parser.parse_args()
+
+    import json
+    from storage import create_storage
+    lookup = NegativeLookup(args.filter or args.database + '.bloom', args.capacity, args.error_rate)
+    if args.command == 'rebuild':
+        store = create_storage(f'sqlite:///{args.database}?shards={args.shards}')
+        try:
+            lookup.rebuild(store.iter_ids, store.count(), watermark=store.id_watermark())
+        finally:
+            store.close()
+    print(json.dumps(lookup.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""In-process cache of hot note content.
+
+Multi-view and time-limited notes tend to be opened several times in quick
+succession right after the link is shared. The cache keeps their content in
+memory so repeat views skip reading the body back out of SQLite. It only ever
+holds content: view counts and expiry stay authoritative in the database, and
+an entry never outlives the note's own expires_at.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 300
+# Bodies larger than this are not worth pinning in memory
+DEFAULT_MAX_ITEM_SIZE = 64 * 1024
+
+
+# Bounded LRU with a per-entry deadline
+class NoteCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 max_item_size=DEFAULT_MAX_ITEM_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_item_size = max_item_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, note_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(note_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            content, deadline = entry
+            if deadline <= now:
+                del self._entries[note_id]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(note_id)
+            self.hits += 1
+            return content
+
+    # expires_at is the note's own Unix expiry (or None); the entry is dropped
+    # no later than that even if nobody invalidates it.
+    def put(self, note_id, content, expires_at=None):
+        if self.max_entries <= 0 or len(content) > self.max_item_size:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._entries[note_id] = (content, deadline)
+            self._entries.move_to_end(note_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, note_id):
+        with self._lock:
+            self._entries.pop(note_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def get_cache(app=None):
+    return (app or current_app).extensions['note_cache']
+
+
+def init_app(app):
+    app.extensions['note_cache'] = NoteCache(
+        max_entries=int(app.config.get('NOTE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)),
+        ttl=float(app.config.get('NOTE_CACHE_TTL', DEFAULT_TTL)),
+        max_item_size=int(app.config.get('NOTE_CACHE_MAX_ITEM_SIZE', DEFAULT_MAX_ITEM_SIZE)),
+    )
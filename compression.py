@@ -0,0 +1,93 @@
+"""Transparent compression of note bodies.
+
+Bodies at or above a size threshold are compressed before they are written
+and tagged with the codec used; everything else (including every row written
+before compression existed) is stored as plain text with no tag, so old and
+new rows can be read side by side.
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+# Value of the notes.encoding column for uncompressed rows
+RAW = None
+# Uncompressed UTF-8 bytes stored as a BLOB (streamed uploads)
+BLOB = 'blob'
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+DEFAULT_THRESHOLD = 1024
+DEFAULT_LEVEL = 6
+# Keep the plain text unless compression saves at least this fraction
+MIN_SAVING = 0.1
+
+
+class Codec:
+    def __init__(self, method=ZLIB, threshold=DEFAULT_THRESHOLD, level=DEFAULT_LEVEL):
+        if method == ZSTD and zstandard is None:
+            raise RuntimeError('CONTENT_COMPRESSION=zstd needs the zstandard package')
+        if method not in (ZLIB, ZSTD, 'none'):
+            raise ValueError(f'unknown compression method: {method}')
+        self.method = None if method == 'none' else method
+        self.threshold = threshold
+        self.level = level
+
+    # Returns (value to store, encoding tag)
+    def encode(self, content):
+        if self.method is None:
+            return content, RAW
+        data = content.encode('utf-8')
+        if len(data) < self.threshold:
+            return content, RAW
+        packed = self.compress(data)
+        if len(packed) > len(data) * (1 - MIN_SAVING):
+            return content, RAW
+        return packed, self.method
+
+    def decode(self, value, encoding):
+        if encoding is RAW:
+            return value
+        if encoding == BLOB:
+            return bytes(value).decode('utf-8', 'replace')
+        if encoding == ZLIB:
+            return zlib.decompress(value).decode('utf-8')
+        if encoding == ZSTD:
+            if zstandard is None:
+                raise RuntimeError('note was stored with zstd but zstandard is not installed')
+            return zstandard.ZstdDecompressor().decompress(value).decode('utf-8')
+        raise ValueError(f'unknown content encoding: {encoding}')
+
+    # Decode a stored value handed over as an iterable of byte chunks, yielding
+    # plain UTF-8 byte chunks without ever holding the whole body.
+    def iter_decode(self, chunks, encoding):
+        if encoding is RAW or encoding == BLOB:
+            yield from chunks
+            return
+        if encoding == ZLIB:
+            decompressor = zlib.decompressobj()
+        elif encoding == ZSTD and zstandard is not None:
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            raise ValueError(f'cannot stream content encoding: {encoding}')
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    # Compress bytes with the configured codec, regardless of the threshold
+    def compress(self, data):
+        if self.method == ZSTD:
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return zlib.compress(data, self.level)
+
+
+def from_config(config):
+    return Codec(config.get('CONTENT_COMPRESSION', ZLIB),
+                 int(config.get('COMPRESSION_THRESHOLD', DEFAULT_THRESHOLD)),
+                 int(config.get('COMPRESSION_LEVEL', DEFAULT_LEVEL)))
@@ -0,0 +1,137 @@
+import atexit
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+import metrics
+
+# PRAGMAs applied once when a pooled connection is opened. auto_vacuum only
+# takes effect on a brand new database (so it must come before journal_mode,
+# which writes the header); journal_mode=WAL is persistent in the file; the
+# rest are per-connection settings.
+DEFAULT_PRAGMAS = (
+    ('auto_vacuum', 'INCREMENTAL'),
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 64 * 1024 * 1024),
+)
+
+
+# Connection that times its statements for the db_seconds metric. COMMIT is
+# reported separately since that's where the WAL gets written and synced.
+class TimedConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.DB_SECONDS.observe(time.perf_counter() - start,
+                                       'commit' if sql == 'COMMIT' else 'query')
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            metrics.DB_SECONDS.observe(time.perf_counter() - start, 'query')
+
+
+# Pool of long-lived SQLite connections. Callers check one out per operation
+# and hand it straight back, so a sync gunicorn worker keeps reusing the same
+# connection instead of reconnecting (and re-running PRAGMAs) per call.
+class ConnectionPool:
+    def __init__(self, path, pragmas=DEFAULT_PRAGMAS, max_idle=8):
+        self.path = path
+        self.pragmas = pragmas
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        # isolation_level=None leaves single statements in autocommit mode;
+        # multi-statement work goes through transaction() explicitly.
+        start = time.perf_counter()
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        metrics.DB_SECONDS.observe(time.perf_counter() - start, 'connect')
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn):
+        # Never hand a connection with an open transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    # Close the idle connections but keep the pool usable. A process about to
+    # fork calls this so no SQLite connection is inherited by the children.
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+        self.clear()
+
+
+# Check a connection out of the pool for the duration of a with block
+@contextmanager
+def pooled(pool):
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+# Explicit write transaction on a pooled (autocommit) connection. BEGIN
+# IMMEDIATE takes the write lock up front so the transaction can't fail
+# halfway with SQLITE_BUSY when upgrading from a read lock.
+@contextmanager
+def transaction(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+_pool_lock = threading.Lock()
+
+
+# The app's pool for path (by default its DATABASE), created on first use
+def get_pool(app=None, path=None):
+    app = app or current_app
+    path = path or app.config['DATABASE']
+    pools = app.extensions.setdefault('db_pools', {})
+    pool = pools.get(path)
+    if pool is None:
+        with _pool_lock:
+            pool = pools.get(path)
+            if pool is None:
+                pool = ConnectionPool(path)
+                pools[path] = pool
+                atexit.register(pool.close_all)
+    return pool
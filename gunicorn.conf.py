@@ -0,0 +1,89 @@
+"""Gunicorn settings for EphemeralBin.
+
+    gunicorn                      # picks this file up from the working directory
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded in the master, which creates the schema once and closes
+its database connections before any worker is forked. Each worker then starts
+a sweeper (if SWEEP_INTERVAL is set) and negative-lookup filter rebuild thread
+(if NEGATIVE_FILTER is set); see threads.start_once. The workers' sweepers
+take turns through a lock file, as the filter rebuilds do, so the database is
+swept by one of them at a time.
+
+Tuned through the environment:
+
+    WEB_CONCURRENCY        worker processes (default: 2 x CPUs + 1)
+    GUNICORN_WORKER_CLASS  sync (default), gthread, or an ASGI worker such as
+                           uvicorn.workers.UvicornWorker (serves asgi.py)
+    GUNICORN_THREADS       threads per gthread worker (default 1)
+    GUNICORN_TIMEOUT       seconds before a silent worker is restarted (default 30)
+    PORT / GUNICORN_BIND   listen address (default 0.0.0.0:$PORT, PORT=5000)
+    SECRET_KEY             session signing key shared by all workers
+    METRICS_DIR            where workers share /metrics numbers (default: a
+                           fresh temporary directory per master)
+    ASSETS_BUILD           0 to skip building static/dist/ at startup (when
+                           the image already has a build)
+"""
+import multiprocessing
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+wsgi_app = 'asgi:application' if 'uvicorn' in worker_class.lower() else 'app:app'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:' + os.environ.get('PORT', '5000'))
+preload_app = True
+
+# The preloaded app reads static/dist/manifest.json when it is created, so
+# the build has to happen first: here, as gunicorn reads its config. A build
+# that fails (read-only checkout) leaves pages on /static/ and the CDNs.
+if os.environ.get('ASSETS_BUILD', '1') != '0':
+    import assets
+    try:
+        assets.build(log=lambda message: None)
+    except OSError as exc:
+        print(f'static assets not built: {exc}', file=sys.stderr)
+    assets.check_vendor()
+
+# Workers leave metric snapshots here so /metrics can add up all of them.
+# The directory is per master, so counters start from zero on restart.
+_metrics_dir = not os.environ.get('METRICS_DIR')
+if _metrics_dir:
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='ephemeralbin-metrics-')
+
+# Workers inherit the master's environment, so a key drawn here is at least
+# shared by all of them; it still changes on every restart.
+_generated_secret = not os.environ.get('SECRET_KEY')
+if _generated_secret:
+    os.environ['SECRET_KEY'] = secrets.token_hex(32)
+
+
+def when_ready(server):
+    from app import app, init_db
+    if _generated_secret:
+        server.log.warning('SECRET_KEY is not set; sessions will not survive a restart')
+    init_db(app)
+
+
+# Runs in the master before every fork, including workers respawned later
+def pre_fork(server, worker):
+    from app import app, before_fork
+    before_fork(app)
+
+
+def on_exit(server):
+    if _metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def post_worker_init(worker):
+    import bloom
+    import sweeper
+    from app import app
+    sweeper.start(app)
+    bloom.start(app)
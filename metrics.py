@@ -0,0 +1,325 @@
+"""Prometheus metrics.
+
+GET /metrics serves the text exposition format:
+
+    ephemeralbin_http_requests_total        requests by route, method and status
+    ephemeralbin_http_request_seconds       request latency histogram by route
+    ephemeralbin_db_seconds                 SQLite time by phase (connect, query, commit)
+    ephemeralbin_notes_created_total        notes stored
+    ephemeralbin_notes_removed_total        notes removed, by reason (views, time,
+                                            deleted) and trigger (view, sweep, manual)
+    ephemeralbin_live_notes                 notes currently stored
+    ephemeralbin_database_bytes             database file size, WAL included
+    ephemeralbin_dedup_*                    shared note bodies: count, bytes saved, ratio
+    ephemeralbin_note_cache_*_total         hot-note cache hits, misses and evictions
+    ephemeralbin_note_cache_entries         notes held by the caches of running workers
+
+Recording is a dict update under one uncontended lock. Each process keeps its
+own numbers; with METRICS_DIR set (the gunicorn config does this) every
+process also writes a snapshot there once a second, and /metrics adds
+up the snapshots of all workers, past and present.
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import Response, current_app, request
+
+import threads
+
+PREFIX = 'ephemeralbin_'
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+DB_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 1)
+# Seconds between snapshot writes to METRICS_DIR
+DUMP_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_registry = []
+# Functions copying numbers kept elsewhere into metrics, run before every
+# snapshot; by name, so a rebuilt app replaces its own
+_collectors = {}
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    # For totals counted by someone else (see add_collector)
+    def set(self, value, *labels):
+        with _lock:
+            self.values[labels] = value
+
+    # Add a snapshot value into values (a dict like self.values)
+    def merge(self, values, labels, value):
+        values[labels] = values.get(labels, 0) + value
+
+    def samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield self.name, self.labels, labels, value
+
+
+# Current value per process, added up over the processes still running
+class Gauge(Counter):
+    kind = 'gauge'
+
+
+# Bucket counts are kept per bucket and only made cumulative when rendered,
+# so observe() is one bisect and two additions.
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # one slot per bucket, +Inf, then the sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def merge(self, values, labels, value):
+        counts = values.setdefault(labels, [0] * (len(self.buckets) + 2))
+        for index, amount in enumerate(value):
+            counts[index] += amount
+
+    def samples(self, values):
+        for labels, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                yield self.name + '_bucket', self.labels + ('le',), labels + (_number(bound),), total
+            yield self.name + '_sum', self.labels, labels, counts[-1]
+            yield self.name + '_count', self.labels, labels, total
+
+
+REQUESTS = Counter('http_requests_total', 'Requests handled.', ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('http_request_seconds', 'Request latency in seconds.', ('route',))
+DB_SECONDS = Histogram('db_seconds', 'Time spent in SQLite, by phase.', ('phase',), DB_BUCKETS)
+NOTES_CREATED = Counter('notes_created_total', 'Notes stored.')
+NOTES_REMOVED = Counter('notes_removed_total', 'Notes removed.', ('reason', 'trigger'))
+NOTE_CACHE_HITS = Counter('note_cache_hits_total', 'Views served from the hot-note cache.')
+NOTE_CACHE_MISSES = Counter('note_cache_misses_total', 'Cache lookups that had to read the body from storage.')
+NOTE_CACHE_EVICTIONS = Counter('note_cache_evictions_total', 'Cache entries dropped for space or age.')
+NOTE_CACHE_ENTRIES = Gauge('note_cache_entries', 'Notes held in the hot-note caches.')
+
+
+def add_collector(name, collect):
+    _collectors[name] = collect
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(name, label_names, label_values, value):
+    if label_names:
+        labels = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(label_names, label_values))
+        name = f'{name}{{{labels}}}'
+    return f'{name} {_number(value)}'
+
+
+def snapshot():
+    for collect in list(_collectors.values()):
+        collect()
+    with _lock:
+        return {metric.name: [[list(labels), value if isinstance(value, (int, float)) else list(value)]
+                              for labels, value in metric.values.items()]
+                for metric in _registry}
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics-{pid}.json')
+
+
+def _alive(path):
+    try:
+        os.kill(int(os.path.basename(path)[len('metrics-'):-len('.json')]), 0)
+    except ValueError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+# Writes this process's snapshot every DUMP_INTERVAL from a daemon thread,
+# started on first use in each process (see threads.start_once)
+class _Dumper:
+    def __init__(self, directory):
+        self.directory = directory
+        self._threads = {}
+
+    def ensure_started(self):
+        threads.start_once(self._threads, 'dumper', lambda: threads.PeriodicThread(
+            'metrics-dumper', DUMP_INTERVAL, self.dump))
+
+    # The directory may already be gone when a process exits
+    def dump(self):
+        try:
+            self._write()
+        except OSError:
+            pass
+
+    def _write(self):
+        path = _snapshot_path(self.directory, os.getpid())
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(snapshot(), fh)
+        os.replace(tmp, path)
+
+
+# This process's live numbers plus the snapshots other processes left in
+# directory
+def collect(directory=None):
+    merged = {metric.name: {} for metric in _registry}
+    snapshots = [(snapshot(), True)]
+    if directory:
+        own = _snapshot_path(directory, os.getpid())
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as fh:
+                    snapshots.append((json.load(fh), _alive(path)))
+            except (OSError, ValueError):
+                continue
+    by_name = {metric.name: metric for metric in _registry}
+    for data, alive in snapshots:
+        for name, entries in data.items():
+            metric = by_name.get(name)
+            # Counters of exited workers still count; their gauges don't
+            if metric is None or (metric.kind == 'gauge' and not alive):
+                continue
+            for labels, value in entries:
+                metric.merge(merged[name], tuple(labels), value)
+    return merged
+
+
+def render(gauges=()):
+    directory = current_app.config.get('METRICS_DIR')
+    merged = collect(directory)
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(_format(*sample) for sample in metric.samples(merged[metric.name]))
+    for name, help, value in gauges:
+        if value is None:
+            continue
+        lines.append(f'# HELP {PREFIX}{name} {help}')
+        lines.append(f'# TYPE {PREFIX}{name} gauge')
+        lines.append(f'{PREFIX}{name} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _live_notes():
+    import storage
+    try:
+        return storage.get_storage().count()
+    except NotImplementedError:
+        return None
+
+
+def _database_bytes():
+    import storage
+    paths = storage.database_paths()
+    if not paths:
+        return None
+    return sum(os.path.getsize(name) for path in paths for name in (path, path + '-wal')
+               if os.path.exists(name))
+
+
+def _dedup_stats():
+    import storage
+    try:
+        return storage.get_storage().dedup_stats()
+    except NotImplementedError:
+        return {}
+
+
+def metrics_view():
+    dedup = _dedup_stats()
+    body = render([
+        ('live_notes', 'Notes currently stored.', _live_notes()),
+        ('database_bytes', 'Size of the SQLite database files, WAL included.', _database_bytes()),
+        ('dedup_bodies', 'Distinct note bodies stored once for several notes.', dedup.get('bodies')),
+        ('dedup_bytes_saved', 'Bytes not stored thanks to shared note bodies.', dedup.get('bytes_saved')),
+        ('dedup_ratio', 'Bytes referenced by notes per byte stored, shared bodies only.', dedup.get('dedup_ratio')),
+    ])
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def _start_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+
+
+# Serve /metrics, time every request and count note lifecycle events by
+# wrapping the app's storage engine
+def init_app(app):
+    import storage
+    app.extensions['storage'] = storage.MeteredStorage(app.extensions['storage'])
+    note_cache = app.extensions.get('note_cache')
+    if note_cache is not None:
+        def collect_cache():
+            stats = note_cache.stats()
+            NOTE_CACHE_HITS.set(stats['hits'])
+            NOTE_CACHE_MISSES.set(stats['misses'])
+            NOTE_CACHE_EVICTIONS.set(stats['evictions'])
+            NOTE_CACHE_ENTRIES.set(stats['entries'])
+        add_collector('note_cache', collect_cache)
+    directory = app.config.get('METRICS_DIR')
+    dumper = _Dumper(directory) if directory else None
+    if dumper is not None:
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(dumper.dump)
+
+    def record(response):
+        environ = request.environ
+        start = environ.pop('metrics.start', None)
+        if start is not None:
+            route = request.endpoint or 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+            REQUESTS.inc(route, request.method, str(response.status_code))
+        if dumper is not None:
+            dumper.ensure_started()
+        return response
+
+    # after_request is skipped when a view raises; count those as 500s
+    def record_failure(exc):
+        if exc is not None and 'metrics.start' in request.environ:
+            record(Response(status=500))
+
+    app.before_request(_start_timer)
+    app.after_request(record)
+    app.teardown_request(record_failure)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
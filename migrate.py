@@ -0,0 +1,93 @@
+"""Versioned schema migrations for the SQLite note store.
+
+Every database records the migrations applied to it in schema_migrations
+(see storage/migrations.py). The app applies pending ones itself the first
+time it uses storage (under gunicorn, in the master before forking), so
+this is for looking ahead and for running slow ones before a deploy:
+
+    python migrate.py status --database notes.db
+    python migrate.py dry-run --database notes.db
+    python migrate.py up --database notes.db
+    python migrate.py up --database notes.db --shards 4 --to 3
+
+dry-run applies the pending migrations to a copy of each database, taken
+with SQLite's online backup so the app can keep serving, and reports for
+each how long it took, how many write transactions it used, the longest of
+them (how long a view_note could have waited on the write lock) and the
+rows it changed. The copy needs as much free space as the database.
+
+up runs against the live files. Data migrations commit every --batch-size
+rows along with their progress, sleeping --pause seconds in between so
+requests get the write lock; stop it at any time and run it (or start the
+app) again to carry on.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import db
+from storage import migrations
+from storage.sharded import shard_paths
+
+
+def _rounded(report):
+    return {name: round(value, 4) if isinstance(value, float) else value for name, value in report.items()}
+
+
+def status(path):
+    pool = db.ConnectionPool(path)
+    try:
+        with db.pooled(pool) as conn:
+            return {'version': migrations.current_version(conn), 'latest': migrations.LATEST,
+                    'migrations': migrations.status(conn)}
+    finally:
+        pool.close_all()
+
+
+def up(path, target, batch_size, pause):
+    pool = db.ConnectionPool(path)
+    try:
+        with db.pooled(pool) as conn:
+            reports = migrations.migrate(conn, target, batch_size, pause)
+            return {'version': migrations.current_version(conn), 'applied': [_rounded(r) for r in reports]}
+    finally:
+        pool.close_all()
+
+
+def dry_run(path, batch_size, copy_dir):
+    handle, copy_path = tempfile.mkstemp(prefix='migrate-dry-run-', suffix='.db', dir=copy_dir)
+    os.close(handle)
+    os.remove(copy_path)
+    reports = migrations.dry_run(path, copy_path, batch_size)
+    return {'estimates': [_rounded(report) for report in reports],
+            'total_seconds': round(sum(report['seconds'] for report in reports), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('command', choices=['status', 'up', 'dry-run'])
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', 'notes.db'))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('DATABASE_SHARDS', 1)))
+    parser.add_argument('--to', type=int, help='stop after this version (up only)')
+    parser.add_argument('--batch-size', type=int, default=migrations.BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=migrations.PAUSE,
+                        help='seconds between batches (up only)')
+    parser.add_argument('--copy-dir', help='where dry-run puts its copy (default: the temp directory)')
+    args = parser.parse_args()
+
+    result = {}
+    for path in shard_paths(args.database, args.shards):
+        if not os.path.exists(path):
+            parser.error(f'{path} does not exist')
+        if args.command == 'status':
+            result[path] = status(path)
+        elif args.command == 'up':
+            result[path] = up(path, args.to, args.batch_size, args.pause)
+        else:
+            result[path] = dry_run(path, args.batch_size, args.copy_dir)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
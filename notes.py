@@ -0,0 +1,79 @@
+import functools
+import math
+import secrets
+import string
+import time
+
+from flask import current_app
+
+from storage.base import NoteExists
+
+# The fixed choices offered by the HTML form: (max_views, lifetime in seconds)
+EXPIRATION_TYPES = {
+    '1_view': (1, None),
+    '5_views': (5, None),
+    '10_views': (10, None),
+    '10_minutes': (None, 10 * 60),
+    '1_hour': (None, 60 * 60),
+    '24_hours': (None, 24 * 60 * 60),
+}
+
+ALPHABETS = {
+    'base62': string.ascii_letters + string.digits,
+    'base64url': string.ascii_uppercase + string.ascii_lowercase + string.digits + '-_',
+}
+DEFAULT_ID_LENGTH = 12
+# Fresh ids tried before giving up when the generated one is already taken
+ID_ATTEMPTS = 5
+
+# Generate unique note ID. All the entropy is drawn in one token_bytes call
+# and then spelled out in the alphabet, instead of one secrets.choice per
+# character. 64 spare bits keep the modulo bias negligible.
+def generate_note_id(length=DEFAULT_ID_LENGTH, alphabet=ALPHABETS['base62']):
+    if alphabet == ALPHABETS['base64url']:
+        # Each base64 character is exactly 6 random bits
+        return secrets.token_urlsafe(math.ceil(length * 6 / 8))[:length]
+    base = len(alphabet)
+    value = int.from_bytes(secrets.token_bytes(_entropy_bytes(length, base)), 'big')
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, base)
+        chars.append(alphabet[digit])
+    return ''.join(chars)
+
+@functools.lru_cache(maxsize=None)
+def _entropy_bytes(length, base):
+    return math.ceil((length * math.log2(base) + 64) / 8)
+
+# Id for a new note using the app's NOTE_ID_LENGTH / NOTE_ID_ALPHABET
+def new_note_id():
+    config = current_app.config
+    alphabet = config.get('NOTE_ID_ALPHABET', 'base62')
+    return generate_note_id(config.get('NOTE_ID_LENGTH', DEFAULT_ID_LENGTH),
+                            ALPHABETS.get(alphabet, alphabet))
+
+# Call create(note_id) with fresh ids until one isn't taken. Returns the id
+# used.
+def allocate_note_id(create):
+    for _ in range(ID_ATTEMPTS):
+        note_id = new_note_id()
+        try:
+            create(note_id)
+        except NoteExists:
+            continue
+        return note_id
+    raise NoteExists('no free note id after %d attempts' % ID_ATTEMPTS)
+
+# Store a note under a fresh id, drawing a new one if the id is taken
+def store_note(store, content, max_views=None, expires_at=None):
+    return allocate_note_id(lambda note_id: store.create(note_id, content, max_views, expires_at))
+
+# Unix time (UTC seconds) a note with the given lifetime expires at
+def expiry_after(seconds):
+    return int(time.time()) + seconds
+
+# Turn a form expiration_type into (max_views, expires_at). Unknown types
+# set neither, as the form always did.
+def parse_expiration_type(expiration_type):
+    max_views, lifetime = EXPIRATION_TYPES.get(expiration_type, (None, None))
+    return max_views, (expiry_after(lifetime) if lifetime else None)
@@ -0,0 +1,124 @@
+"""Pre-rendered responses for the pages that hardly ever change.
+
+The expired/missing note page is the most requested page (scanners and stale
+links) but only ever shows one of two fixed messages, so it is rendered once
+and served from bytes with a strong ETag. The URL is a note's, so caches
+must revalidate it every time (no-cache) rather than keep answering "gone"
+for it; the revalidation is a cheap 304. The success page only varies by
+the note URL, so it is rendered once around placeholders and filled in by
+string joins instead of a Jinja render per create.
+
+Pages are rendered per script root, and the cache is bypassed while flashed
+messages are pending or templates are being auto-reloaded.
+
+Compiling a template costs a new process several milliseconds on its first
+render of it. With TEMPLATE_CACHE_DIR set, compiled templates are kept there
+as bytecode and reused by later processes; warm_templates() compiles all of
+them ahead of the first request (the gunicorn master does, so its workers
+start with them in memory).
+"""
+import hashlib
+import os
+import re
+import threading
+
+from flask import current_app, make_response, render_template, request, session
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import escape
+
+class PageCache:
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        page = self._pages.get(key)
+        if page is None:
+            page = build()
+            with self._lock:
+                self._pages.setdefault(key, page)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+# A rendered page split around placeholder tokens
+class Skeleton:
+    def __init__(self, html, placeholders):
+        names = {token: name for name, token in placeholders.items()}
+        pattern = re.compile('|'.join(re.escape(token) for token in names))
+        self.parts = pattern.split(html)
+        self.names = [names[match.group()] for match in pattern.finditer(html)]
+
+    def fill(self, **values):
+        escaped = {name: str(escape(value)) for name, value in values.items()}
+        out = [self.parts[0]]
+        for name, part in zip(self.names, self.parts[1:]):
+            out.append(escaped[name])
+            out.append(part)
+        return ''.join(out)
+
+
+def _cache():
+    return current_app.extensions['page_cache']
+
+
+# Pre-rendering is only safe when the page would render the same way
+def _cacheable():
+    if current_app.debug or current_app.config.get('TEMPLATES_AUTO_RELOAD'):
+        return False
+    cookie = current_app.config.get('SESSION_COOKIE_NAME', 'session')
+    return cookie not in request.cookies or not session.get('_flashes')
+
+
+def _render_static(template, context):
+    body = render_template(template, **context).encode('utf-8')
+    return body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+# Fixed page served from cached bytes with a strong ETag; answers
+# If-None-Match with 304 without touching the body. Not fresh for any time:
+# whether the URL still shows this page is up to storage.
+def static_page(template, **context):
+    if not _cacheable():
+        return render_template(template, **context)
+    key = ('static', template, tuple(sorted(context.items())), request.script_root)
+    body, etag = _cache().get(key, lambda: _render_static(template, context))
+    if etag in request.headers.get('If-None-Match', ''):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, mimetype='text/html')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# Page whose only varying parts are the given values. The skeleton is
+# rendered once with placeholder tokens; each request just joins strings.
+def parameterized_page(template, **values):
+    if not _cacheable():
+        return make_response(render_template(template, **values))
+    key = ('skeleton', template, tuple(sorted(values)), request.script_root)
+
+    def build():
+        placeholders = {name: f'@@page-placeholder-{name}@@' for name in values}
+        return Skeleton(render_template(template, **placeholders), placeholders)
+
+    return make_response(_cache().get(key, build).fill(**values))
+
+
+# Compile every template now instead of on its first render
+def warm_templates(app):
+    env = app.jinja_env
+    for name in env.list_templates():
+        env.get_template(name)
+
+
+def init_app(app):
+    app.extensions['page_cache'] = PageCache()
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
@@ -0,0 +1,273 @@
+"""Sampled request profiling, written as collapsed stacks for flame graphs.
+
+Off unless PROFILE_DIR is set. Then a share of requests (PROFILE_SAMPLE_RATE,
+default 0) is profiled, and so is any request carrying an X-Profile header
+equal to PROFILE_TOKEN. While a profiled request runs, a sampler thread
+records its thread's Python stack every PROFILE_INTERVAL seconds (default
+0.005), so the samples show wall time: Jinja rendering, date parsing and
+time spent waiting on SQLite all count. Each process adds its samples up by
+stack and rewrites PROFILE_DIR/profile-<pid>.collapsed every few seconds, one
+"route;outer;...;inner count" line per stack.
+
+The rate can be changed without restarting workers; they re-read it from
+PROFILE_DIR within a second:
+
+    python profiling.py rate 0.01 --dir /tmp/profiles
+    python profiling.py rate off --dir /tmp/profiles
+    python profiling.py merge --dir /tmp/profiles > app.folded
+    python profiling.py merge --dir /tmp/profiles --route view_note > view.folded
+    python profiling.py reset --dir /tmp/profiles
+
+Feed the merged output to flamegraph.pl or https://www.speedscope.app.
+Under ASGI, native routes are sampled on the event loop thread and on the
+pool thread running their storage call; loop samples taken while the request
+is awaiting can belong to other requests.
+"""
+import argparse
+import atexit
+import contextvars
+import glob
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+
+from flask import current_app, request
+
+import threads
+
+DEFAULT_INTERVAL = 0.005
+# Seconds between rewrites of this process's profile file
+WRITE_INTERVAL = 5.0
+# Seconds between checks of the rate file
+RATE_CHECK_INTERVAL = 1.0
+RATE_FILE = 'sample_rate'
+# Touched by `reset`; running processes drop their samples when it changes
+RESET_FILE = 'reset'
+
+# Route of the request being profiled in this context, so work handed to
+# another thread (see call()) is sampled under the same route
+_current = contextvars.ContextVar('profiled_route', default=None)
+
+
+def _profile_path(directory, pid):
+    return os.path.join(directory, f'profile-{pid}.collapsed')
+
+
+def _collapse(route, frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    names.append(route)
+    return ';'.join(reversed(names))
+
+
+# Samples the stacks of the threads currently serving profiled requests.
+# The thread is started on first use in each process (see threads.start_once)
+# and sleeps while nothing is being profiled.
+class Sampler:
+    def __init__(self, directory, interval=DEFAULT_INTERVAL, default_rate=0.0):
+        self.directory = directory
+        self.interval = interval
+        self.default_rate = default_rate
+        self.stacks = {}
+        self.dirty = False
+        self._active = {}
+        self._busy = threading.Event()
+        self._lock = threading.Lock()
+        self._rate = default_rate
+        self._next_rate_check = 0
+        self._next_write = 0
+        self._reset_at = _mtime(os.path.join(directory, RESET_FILE))
+        self._threads = {}
+
+    # Share of requests to profile: the rate file if there is one, else the
+    # configured default
+    def rate(self):
+        now = time.monotonic()
+        if now >= self._next_rate_check:
+            self._next_rate_check = now + RATE_CHECK_INTERVAL
+            self._rate = read_rate(self.directory, self.default_rate)
+            reset_at = _mtime(os.path.join(self.directory, RESET_FILE))
+            if reset_at != self._reset_at:
+                self._reset_at = reset_at
+                with self._lock:
+                    self.stacks = {}
+        return self._rate
+
+    def enter(self, route):
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = route
+            self._busy.set()
+
+    def leave(self):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def _ensure_started(self):
+        threads.start_once(self._threads, 'sampler', self._new_thread)
+
+    # Stacks and requests seen so far belong to the parent process
+    def _new_thread(self):
+        with self._lock:
+            self.stacks = {}
+            self._active = {}
+        return threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+
+    def run(self):
+        while True:
+            if not self._busy.is_set() and self.dirty:
+                self.write()
+            self._busy.wait()
+            # Jittered, or requests shorter than the interval that start
+            # while the sampler is idle would never be sampled
+            time.sleep(random.uniform(0, 2 * self.interval))
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, route in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stack = _collapse(route, frame)
+                        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                        self.dirty = True
+                if not self._active:
+                    self._busy.clear()
+            del frames
+            if time.monotonic() >= self._next_write:
+                self.write()
+
+    def write(self):
+        self._next_write = time.monotonic() + WRITE_INTERVAL
+        with self._lock:
+            if threads.current(self._threads, 'sampler') is None:
+                return
+            self.dirty = False
+            lines = [f'{stack} {count}\n' for stack, count in sorted(self.stacks.items())]
+        path = _profile_path(self.directory, os.getpid())
+        try:
+            with open(path + '.tmp', 'w') as fh:
+                fh.writelines(lines)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_rate(directory, default=0.0):
+    try:
+        with open(os.path.join(directory, RATE_FILE)) as fh:
+            return float(fh.read().strip() or 0)
+    except (OSError, ValueError):
+        return default
+
+
+# Run func(*args), sampling this thread too if the calling context belongs
+# to a profiled request. asgi.run_blocking uses it for pool calls.
+def call(func, *args):
+    route = _current.get()
+    sampler = _sampler
+    if route is None or sampler is None:
+        return func(*args)
+    sampler.enter(route)
+    try:
+        return func(*args)
+    finally:
+        sampler.leave()
+
+
+_sampler = None
+
+
+def _wants_profile(sampler):
+    token = current_app.config.get('PROFILE_TOKEN')
+    header = request.headers.get('X-Profile')
+    # As bytes: compare_digest rejects non-ASCII str. Header values arrive
+    # decoded as latin-1, so this gives back the bytes the client sent.
+    if token and header and secrets.compare_digest(header.encode('latin-1'), token.encode()):
+        return True
+    rate = sampler.rate()
+    return rate > 0 and random.random() < rate
+
+
+# Profile a sample of requests if PROFILE_DIR is configured
+def init_app(app):
+    global _sampler
+    directory = app.config.get('PROFILE_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    sampler = _sampler = Sampler(directory, app.config.get('PROFILE_INTERVAL') or DEFAULT_INTERVAL,
+                                 app.config.get('PROFILE_SAMPLE_RATE') or 0.0)
+    atexit.register(sampler.write)
+
+    @app.before_request
+    def start_profile():
+        if not _wants_profile(sampler):
+            return
+        route = request.endpoint or 'unmatched'
+        request.environ['profiling.token'] = _current.set(route)
+        sampler.enter(route)
+
+    @app.teardown_request
+    def stop_profile(exc):
+        token = request.environ.pop('profiling.token', None)
+        if token is not None:
+            sampler.leave()
+            _current.reset(token)
+
+
+def merge(directory, route=None):
+    totals = {}
+    for path in glob.glob(os.path.join(directory, 'profile-*.collapsed')):
+        with open(path) as fh:
+            for line in fh:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if route and stack.split(';', 1)[0] != route:
+                    continue
+                totals[stack] = totals.get(stack, 0) + int(count)
+    return totals
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--dir', default=os.environ.get('PROFILE_DIR'), required='PROFILE_DIR' not in os.environ,
+                        help='profile directory (default: $PROFILE_DIR)')
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    rate = commands.add_parser('rate', parents=[common], help='set the share of requests to profile')
+    rate.add_argument('value', help="a fraction between 0 and 1, or 'off'")
+    merge_cmd = commands.add_parser('merge', parents=[common], help='print the samples of all processes, collapsed')
+    merge_cmd.add_argument('--route', help='only this endpoint, e.g. view_note')
+    commands.add_parser('reset', parents=[common], help='delete collected profiles and start over')
+    args = parser.parse_args(argv)
+
+    if args.command == 'rate':
+        value = 0.0 if args.value == 'off' else float(args.value)
+        if not 0 <= value <= 1:
+            parser.error('rate must be between 0 and 1')
+        os.makedirs(args.dir, exist_ok=True)
+        with open(os.path.join(args.dir, RATE_FILE), 'w') as fh:
+            fh.write(f'{value}\n')
+    elif args.command == 'merge':
+        for stack, count in sorted(merge(args.dir, args.route).items()):
+            print(stack, count)
+    else:
+        for path in glob.glob(os.path.join(args.dir, 'profile-*.collapsed')):
+            os.remove(path)
+        with open(os.path.join(args.dir, RESET_FILE), 'w') as fh:
+            fh.write(f'{time.time()}\n')
+
+
+if __name__ == '__main__':
+    main()
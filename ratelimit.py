@@ -0,0 +1,259 @@
+"""Per-client rate limiting for creating and reading notes.
+
+Each client (by IP, or by a header set by a trusted proxy) has three
+buckets, each configured as "<requests>/<seconds>" and off when unset:
+
+    RATE_LIMIT_CREATE   /create and the create API routes, one token per
+                        note (a batch costs one per item, and may not hold
+                        more than the bucket). Every started
+                        RATE_LIMIT_CREATE_BYTES of request body costs one
+                        more token, so large notes use the budget up faster;
+                        a chunked upload is charged as it is read.
+    RATE_LIMIT_VIEW     /note/<id> and the read API routes
+    RATE_LIMIT_MISS     reads of ids that don't exist. Once a client runs out,
+                        all of its reads are refused until it refills, which
+                        stops id guessing.
+
+Checks run before the request touches storage (a refused /create never even
+reads its body) and answer 429 with Retry-After. The rest of a batch and a
+chunked body are charged once read, still before anything is stored.
+
+Buckets live in process memory by default: token buckets in an LRU capped
+at RATE_LIMIT_MAX_CLIENTS, so memory follows the number of active clients.
+Each worker then limits on its own. Point RATE_LIMIT_URL at Redis (or
+anything speaking its protocol) to share limits between workers and hosts;
+there a bucket is a fixed-window counter, one round-trip per check, which
+can let up to twice the rate through around a window boundary. If Redis is
+unreachable, requests are let through.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+
+from storage.resp import RespClient, RespError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CLIENTS = 100000
+DEFAULT_CREATE_BYTES = 64 * 1024
+# Client keys longer than this (e.g. a forged header) are cut down
+MAX_KEY_LENGTH = 128
+
+CREATE_ENDPOINTS = frozenset({'create_note', 'api.create_note', 'api.create_notes', 'api.create_note_raw'})
+VIEW_ENDPOINTS = frozenset({'view_note', 'api.get_note', 'api.get_note_raw'})
+
+
+# requests per period seconds, with bursts of up to requests
+class Limit:
+    def __init__(self, requests, period):
+        if requests <= 0 or period <= 0:
+            raise ValueError('rate limits must be positive')
+        self.capacity = requests
+        self.period = period
+        self.rate = requests / period
+
+    @classmethod
+    def parse(cls, value):
+        if not value:
+            return None
+        requests, _, period = str(value).partition('/')
+        return cls(int(requests), float(period or 60))
+
+
+# Token buckets in process memory, least recently used evicted first. An
+# evicted client just starts again with a full bucket.
+class LocalBuckets:
+    def __init__(self, max_clients=DEFAULT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Take cost tokens from the client's bucket (or only check that they are
+    # there, with peek). Returns 0 if allowed, else seconds until they are.
+    def take(self, name, client, limit, cost=1, peek=False):
+        now = time.monotonic()
+        key = (name, client)
+        cost = min(cost, limit.capacity)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if peek:
+                    return 0
+                tokens = limit.capacity
+            else:
+                tokens = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+            if tokens < cost:
+                wait = (cost - tokens) / limit.rate
+            else:
+                wait = 0
+                if not peek:
+                    tokens -= cost
+            self._buckets[key] = [tokens, now]
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Fixed-window counters in Redis, shared by every worker using the same
+# server. SET NX gives each window's key its TTL before it is counted, so a
+# key never outlives its window.
+class SharedBuckets:
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(RespClient.from_url(url, timeout=0.5))
+
+    def take(self, name, client, limit, cost=1, peek=False):
+        window_ms = max(int(limit.period * 1000), 1)
+        now_ms = int(time.time() * 1000)
+        window = now_ms // window_ms
+        key = f'{self.prefix}{name}:{client}:{window}'
+        cost = min(cost, limit.capacity)
+        try:
+            if peek:
+                used = int(self.client.execute('GET', key) or 0) + cost
+            else:
+                replies = self.client.pipeline(('SET', key, 0, 'PX', window_ms * 2, 'NX'),
+                                               ('INCRBY', key, cost))
+                if isinstance(replies[1], RespError):
+                    raise replies[1]
+                used = int(replies[1])
+        except (OSError, RespError) as e:
+            logger.warning('rate limit store unavailable, not limiting: %s', e)
+            return 0
+        if used <= limit.capacity:
+            return 0
+        return ((window + 1) * window_ms - now_ms) / 1000
+
+    def close(self):
+        self.client.close()
+
+
+class RateLimiter:
+    def __init__(self, store, create=None, view=None, miss=None,
+                 key_header=None, create_bytes=DEFAULT_CREATE_BYTES):
+        self.store = store
+        self.create = create
+        self.view = view
+        self.miss = miss
+        self.key_header = key_header
+        self.create_bytes = create_bytes
+
+    def client_key(self):
+        key = None
+        if self.key_header:
+            key = request.headers.get(self.key_header)
+        return (key or request.remote_addr or 'unknown')[:MAX_KEY_LENGTH]
+
+    # Seconds the current request has to wait, or 0 to let it through
+    def check(self):
+        endpoint = request.endpoint
+        if endpoint in CREATE_ENDPOINTS:
+            if self.create is None:
+                return 0
+            cost = 1 + (request.content_length or 0) // self.create_bytes
+            return self.store.take('create', self.client_key(), self.create, cost)
+        if endpoint in VIEW_ENDPOINTS:
+            client = self.client_key()
+            if self.miss is not None:
+                wait = self.store.take('miss', client, self.miss, peek=True)
+                if wait:
+                    return wait
+            if self.view is not None:
+                return self.store.take('view', client, self.view)
+        return 0
+
+    def count_miss(self):
+        if self.miss is not None:
+            self.store.take('miss', self.client_key(), self.miss)
+
+    # Create tokens for work check() could not price up front. Returns
+    # seconds to wait (the request must then be refused), or 0.
+    def charge_create(self, cost):
+        if self.create is None or cost <= 0:
+            return 0
+        return self.store.take('create', self.client_key(), self.create, cost)
+
+
+def too_many_requests(wait):
+    if request.blueprint == 'api':
+        response = jsonify(error='rate_limited')
+    else:
+        response = current_app.response_class('Too many requests, try again later.\n',
+                                              mimetype='text/plain')
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def get_limiter(app=None):
+    return (app or current_app).extensions.get('ratelimit')
+
+
+# Called by the read routes when the note id doesn't exist
+def count_miss():
+    limiter = get_limiter()
+    if limiter is not None:
+        limiter.count_miss()
+
+
+# Take the batch's notes after the first (check() charged that one) from
+# the client's create budget. Returns seconds to wait, or 0.
+def charge_batch(notes):
+    limiter = get_limiter()
+    return limiter.charge_create(notes - 1) if limiter is not None else 0
+
+
+# check() prices a body by its Content-Length, which a chunked upload doesn't
+# send, so the upload is charged as it is read: from before to after bytes
+# read, every RATE_LIMIT_CREATE_BYTES boundary crossed costs a token.
+# Returns seconds to wait, or 0.
+def charge_upload(before, after):
+    limiter = get_limiter()
+    if limiter is None:
+        return 0
+    return limiter.charge_create(after // limiter.create_bytes - before // limiter.create_bytes)
+
+
+# Most notes one batch may create: a client's whole create budget, if limited
+def max_batch(default):
+    limiter = get_limiter()
+    if limiter is None or limiter.create is None:
+        return default
+    return min(default, limiter.create.capacity)
+
+
+# Rate limit the create and read routes if any RATE_LIMIT_* bucket is set
+def init_app(app):
+    config = app.config
+    limits = {name: Limit.parse(config.get(f'RATE_LIMIT_{name.upper()}'))
+              for name in ('create', 'view', 'miss')}
+    if not any(limits.values()):
+        return None
+    url = config.get('RATE_LIMIT_URL')
+    if url:
+        store = SharedBuckets.from_url(url)
+    else:
+        store = LocalBuckets(int(config.get('RATE_LIMIT_MAX_CLIENTS') or DEFAULT_MAX_CLIENTS))
+    limiter = app.extensions['ratelimit'] = RateLimiter(
+        store, key_header=config.get('RATE_LIMIT_KEY_HEADER'),
+        create_bytes=int(config.get('RATE_LIMIT_CREATE_BYTES') or DEFAULT_CREATE_BYTES), **limits)
+
+    @app.before_request
+    def limit_request():
+        wait = limiter.check()
+        if wait:
+            return too_many_requests(wait)
+
+    return limiter
@@ -0,0 +1,138 @@
+"""Inspect and rebalance a sharded SQLite note store.
+
+With DATABASE_SHARDS=N notes live in N files next to DATABASE_PATH
+(notes.db -> notes-0.db ... notes-<N-1>.db), each note in the file picked by
+a hash of its id.
+
+    python shards.py stats --database notes.db --shards 4
+    python shards.py reshard --database notes.db --shards 4
+
+reshard moves every note into the shard it belongs to under the new count:
+notes from the unsharded notes.db, from shard files of an earlier count and
+any misplaced in the current set. Rows are copied as stored (compressed
+bodies, view counts and expiry included) in batches, each committed in the
+target before it is deleted from the source; a moved note gets its own copy
+of a deduplicated body. Run it with the app stopped.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+
+import db
+from storage import ShardedStorage
+from storage.sharded import shard_index
+
+COLUMNS = ('id', 'content', 'encoding', 'max_views', 'current_views', 'expires_at',
+           'created_at', 'leased_until')
+BATCH_SIZE = 500
+
+
+def stats(store):
+    shards = []
+    for path, shard in zip(store.paths(), store.shards):
+        notes = shard.count() if os.path.exists(path) else 0
+        size = sum(os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name))
+        shards.append({'path': path, 'notes': notes, 'bytes': size})
+    total = sum(shard['notes'] for shard in shards)
+    return {
+        'shards': shards,
+        'notes': total,
+        # largest shard relative to a perfectly even split
+        'imbalance': max(shard['notes'] for shard in shards) * len(shards) / total if total else None,
+    }
+
+
+# Every SQLite file next to path that may hold notes under another shard count
+def candidate_sources(path):
+    root, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(root) + r'-\d+' + re.escape(ext) + '$')
+    found = [name for name in glob.glob(glob.escape(root) + '-*' + ext) if pattern.match(name)]
+    if os.path.exists(path):
+        found.append(path)
+    return sorted(found)
+
+
+# Move the notes in source that belong elsewhere into store's shards.
+# Returns how many were moved.
+def move_misplaced(store, source_path):
+    paths = store.paths()
+    own = paths.index(source_path) if source_path in paths else None
+    source = db.ConnectionPool(source_path)
+    placeholders = ', '.join('?' * len(COLUMNS))
+    moved = 0
+    last_rowid = 0
+    try:
+        with db.pooled(source) as conn:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes'").fetchone():
+                return 0
+            present = {row['name'] for row in conn.execute('PRAGMA table_info(notes)')}
+            columns = [f'notes.{name}' if name in present else f'NULL AS {name}' for name in COLUMNS]
+            source_table = 'notes'
+            if 'body_id' in present:
+                # Shared bodies are copied into each moved note
+                columns[COLUMNS.index('content')] = 'coalesce(bodies.content, notes.content)'
+                columns[COLUMNS.index('encoding')] = \
+                    'CASE WHEN notes.body_id IS NULL THEN notes.encoding ELSE bodies.encoding END'
+                source_table = 'notes LEFT JOIN bodies ON bodies.id = notes.body_id'
+            while True:
+                rows = conn.execute(f'''
+                    SELECT notes.rowid, {', '.join(columns)} FROM {source_table}
+                    WHERE notes.rowid > ? ORDER BY notes.rowid LIMIT ?
+                ''', (last_rowid, BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                last_rowid = rows[-1][0]
+                groups = {}
+                for row in rows:
+                    index = shard_index(row[1], len(paths))
+                    if index != own:
+                        groups.setdefault(index, []).append(tuple(row)[1:])
+                for index, group in groups.items():
+                    with db.pooled(store.shards[index].pool) as target, db.transaction(target):
+                        target.executemany(
+                            f'INSERT OR IGNORE INTO notes ({", ".join(COLUMNS)}) VALUES ({placeholders})', group)
+                    with db.transaction(conn):
+                        conn.executemany('DELETE FROM notes WHERE id = ?', [(row[0],) for row in group])
+                    moved += len(group)
+    finally:
+        source.close_all()
+    return moved
+
+
+def reshard(path, count):
+    store = ShardedStorage.from_path(path, count)
+    try:
+        store.init_schema()
+        moved = {}
+        for source in candidate_sources(path):
+            moved[source] = move_misplaced(store, source)
+        # Rows from an older file may still carry the old expiry format
+        store.migrate_expiry()
+        leftover = [source for source in candidate_sources(path) if source not in store.paths()]
+        return {'moved': moved, 'no_longer_used': leftover, **stats(store)}
+    finally:
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or rebalance sharded note storage.')
+    parser.add_argument('command', choices=['stats', 'reshard'])
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', 'notes.db'))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('DATABASE_SHARDS', 1)))
+    args = parser.parse_args()
+
+    if args.command == 'reshard':
+        result = reshard(args.database, args.shards)
+    else:
+        store = ShardedStorage.from_path(args.database, args.shards)
+        try:
+            result = stats(store)
+        finally:
+            store.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import threading
+from urllib.parse import parse_qs, urlparse
+
+from flask import current_app
+
+import cache
+import compression
+import db
+from storage.base import (NOTE_EXPIRED, NOTE_LAST_VIEW, NOTE_MISSING, NOTE_VIEWED,
+                          NoteExists, Storage, StorageError)
+from storage.filtered import FilteredStorage
+from storage.memory import MemoryStorage
+from storage.metered import MeteredStorage
+from storage.redis import RedisStorage
+from storage.sharded import ShardedStorage, shard_paths
+from storage.sqlite import SQLiteStorage
+
+__all__ = [
+    'NOTE_EXPIRED', 'NOTE_LAST_VIEW', 'NOTE_MISSING', 'NOTE_VIEWED',
+    'FilteredStorage', 'MemoryStorage', 'MeteredStorage', 'NoteExists', 'RedisStorage', 'SQLiteStorage',
+    'ShardedStorage', 'Storage', 'StorageError', 'create_storage', 'database_paths', 'get_storage',
+    'init_app', 'on_prepare', 'prepare',
+]
+
+_prepare_lock = threading.Lock()
+
+
+# sqlite:///notes.db (relative) or sqlite:////abs/path.db
+def sqlite_path(url):
+    return url[len('sqlite:///'):].split('?', 1)[0]
+
+
+# N from sqlite:///notes.db?shards=N, or None
+def sqlite_shards(url):
+    shards = parse_qs(urlparse(url).query).get('shards')
+    return int(shards[0]) if shards else None
+
+
+# Build an engine from a URL: sqlite:///path[?shards=N], memory:// or
+# redis://host:port/db
+def create_storage(url, note_cache=None):
+    scheme = urlparse(url).scheme
+    if scheme == 'sqlite':
+        shards = sqlite_shards(url) or 1
+        if shards > 1:
+            return ShardedStorage.from_path(sqlite_path(url), shards, note_cache)
+        return SQLiteStorage.from_path(sqlite_path(url), note_cache)
+    if scheme == 'memory':
+        return MemoryStorage()
+    if scheme in ('redis', 'rediss'):
+        return RedisStorage.from_url(url)
+    raise ValueError(f'unsupported storage URL: {url}')
+
+
+# SQLite files holding the app's notes (none for other engines)
+def database_paths(app=None):
+    app = app or current_app
+    url = app.config.get('STORAGE_URL')
+    if url and urlparse(url).scheme != 'sqlite':
+        return []
+    return shard_paths(app.config['DATABASE'], int(app.config.get('DATABASE_SHARDS') or 1))
+
+
+# The app's engine, prepared on first use
+def get_storage(app=None):
+    app = app or current_app
+    if not app.extensions.get('storage_ready'):
+        prepare(app)
+    return app.extensions['storage']
+
+
+# Create the schema, then run the setup registered with on_prepare, once per
+# app. This happens on first use rather than in init_app, so building the app
+# does no I/O and a cold process answers requests that never touch notes
+# (the home page, assets, health checks) without waiting on the database. A
+# preloading server prepares in the master (app.init_db) and its workers
+# inherit the result.
+def prepare(app):
+    with _prepare_lock:
+        if app.extensions.get('storage_ready'):
+            return
+        app.extensions['storage'].init_schema()
+        for setup in app.extensions.get('storage_setup', ()):
+            setup()
+        app.extensions['storage_ready'] = True
+
+
+# Run setup after the schema exists, before storage is first used. It must
+# not call get_storage.
+def on_prepare(app, setup):
+    app.extensions.setdefault('storage_setup', []).append(setup)
+
+
+# STORAGE_URL picks the engine; without it notes live in the SQLite file named
+# by DATABASE (or DATABASE_SHARDS files next to it), sharing the app's
+# connection pools and hot-note cache.
+def init_app(app):
+    url = app.config.get('STORAGE_URL') or 'sqlite:///' + app.config['DATABASE']
+    if urlparse(url).scheme == 'sqlite':
+        app.config['DATABASE'] = sqlite_path(url)
+        app.config['DATABASE_SHARDS'] = sqlite_shards(url) or int(app.config.get('DATABASE_SHARDS') or 1)
+        shards = [SQLiteStorage(db.get_pool(app, path), cache.get_cache(app),
+                                compression.from_config(app.config),
+                                int(app.config.get('VIEW_LEASE_SIZE', 0)),
+                                float(app.config.get('VIEW_LEASE_TTL', 1.0)),
+                                int(app.config.get('DEDUP_MIN_SIZE') or 0))
+                  for path in shard_paths(app.config['DATABASE'], app.config['DATABASE_SHARDS'])]
+        storage = ShardedStorage(shards) if len(shards) > 1 else shards[0]
+    else:
+        storage = create_storage(url)
+    app.extensions['storage'] = storage
+    return storage
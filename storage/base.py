@@ -0,0 +1,98 @@
+# Outcomes of Storage.consume_view
+NOTE_MISSING = 'missing'
+NOTE_EXPIRED = 'expired'
+NOTE_VIEWED = 'viewed'
+NOTE_LAST_VIEW = 'last_view'
+
+
+class StorageError(Exception):
+    pass
+
+
+# Raised by create() when the note id is already taken
+class NoteExists(StorageError):
+    pass
+
+
+# Interface every storage engine implements. Routes only talk to this, so the
+# engine can be swapped via STORAGE_URL without touching app.py.
+class Storage:
+    removal_listener = None
+
+    # Create tables/indexes or whatever the engine needs; safe to call twice
+    def init_schema(self):
+        pass
+
+    # Store a new note. expires_at is a Unix time (UTC seconds) or None.
+    def create(self, note_id, content, max_views=None, expires_at=None):
+        raise NotImplementedError
+
+    # Store many notes given as (note_id, content, max_views, expires_at)
+    # tuples. Notes whose id is already taken are skipped and their positions
+    # returned, so the caller can retry them under new ids without failing the
+    # whole batch.
+    def create_many(self, notes):
+        conflicts = []
+        for index, (note_id, content, max_views, expires_at) in enumerate(notes):
+            try:
+                self.create(note_id, content, max_views, expires_at)
+            except NoteExists:
+                conflicts.append(index)
+        return conflicts
+
+    # Atomically use up one view. Returns (status, content) where status is
+    # one of the NOTE_* constants and content is None unless it was viewed.
+    def consume_view(self, note_id):
+        raise NotImplementedError
+
+    # Store a note whose UTF-8 body is read from a binary file object of
+    # known size. Engines that can't write incrementally read it whole.
+    def create_from_stream(self, note_id, stream, size, max_views=None, expires_at=None):
+        content = stream.read(size).decode('utf-8', 'replace')
+        self.create(note_id, content, max_views, expires_at)
+
+    # Like consume_view, but the body comes back as an iterable of UTF-8
+    # byte chunks so large notes never have to sit in memory whole.
+    def consume_view_stream(self, note_id):
+        status, content = self.consume_view(note_id)
+        if content is None:
+            return status, None
+        return status, iter((content.encode('utf-8'),))
+
+    def delete(self, note_id):
+        raise NotImplementedError
+
+    # Remove notes whose expiry time has passed. Returns the number removed.
+    def sweep_expired(self, batch_size=500):
+        raise NotImplementedError
+
+    # Number of stored notes, including used-up ones not yet removed
+    def count(self):
+        raise NotImplementedError
+
+    # Savings from bodies stored once for many notes, for engines that do so
+    def dedup_stats(self):
+        raise NotImplementedError
+
+    # Have notes consume_view deletes reported, once the delete is committed,
+    # as listener(reason, trigger): reason 'views' when its last view was
+    # used, 'time' when it had expired. Wrappers pass the listener on.
+    def report_removals(self, listener):
+        self.removal_listener = listener
+
+    def _removed(self, reason, trigger='view'):
+        if self.removal_listener is not None:
+            self.removal_listener(reason, trigger)
+
+    # Hand back views reserved by leases that are past their deadline (or all
+    # of them), for engines that lease views. Returns how many were written.
+    def flush_leases(self, everything=False):
+        return 0
+
+    # Close idle connections without shutting the engine down; called before
+    # a preloading server forks its workers
+    def release_connections(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,78 @@
+from storage.base import NOTE_MISSING, Storage
+
+
+# Wraps an engine with a bloom.NegativeLookup. Ids the filter has never seen
+# are answered as missing without touching the engine; every successful
+# create is added to the filter after it has been stored. Deleted notes stay
+# in the filter until the next rebuild, which sweep_expired and
+# bloom.start's thread trigger at most once per rebuild_interval seconds across
+# all processes.
+class FilteredStorage(Storage):
+    def __init__(self, inner, lookup, rebuild_interval):
+        self.inner = inner
+        self.lookup = lookup
+        self.rebuild_interval = rebuild_interval
+
+    def init_schema(self):
+        self.inner.init_schema()
+
+    def create(self, note_id, content, max_views=None, expires_at=None):
+        self.inner.create(note_id, content, max_views, expires_at)
+        self.lookup.add(note_id)
+
+    def create_many(self, notes):
+        notes = list(notes)
+        conflicts = self.inner.create_many(notes)
+        skipped = set(conflicts)
+        for index, note in enumerate(notes):
+            if index not in skipped:
+                self.lookup.add(note[0])
+        return conflicts
+
+    def create_from_stream(self, note_id, stream, size, max_views=None, expires_at=None):
+        self.inner.create_from_stream(note_id, stream, size, max_views, expires_at)
+        self.lookup.add(note_id)
+
+    def consume_view(self, note_id):
+        if not self.lookup.might_exist(note_id):
+            return NOTE_MISSING, None
+        return self.inner.consume_view(note_id)
+
+    def consume_view_stream(self, note_id):
+        if not self.lookup.might_exist(note_id):
+            return NOTE_MISSING, None
+        return self.inner.consume_view_stream(note_id)
+
+    def delete(self, note_id):
+        self.inner.delete(note_id)
+
+    def sweep_expired(self, batch_size=500):
+        removed = self.inner.sweep_expired(batch_size)
+        self.rebuild(min_age=self.rebuild_interval)
+        return removed
+
+    def count(self):
+        return self.inner.count()
+
+    def dedup_stats(self):
+        return self.inner.dedup_stats()
+
+    def id_watermark(self):
+        return self.inner.id_watermark()
+
+    def rebuild(self, min_age=0):
+        watermark = self.inner.id_watermark()
+        return self.lookup.rebuild(self.inner.iter_ids, self.inner.count(), min_age, watermark)
+
+    def report_removals(self, listener):
+        self.inner.report_removals(listener)
+
+    def flush_leases(self, everything=False):
+        return self.inner.flush_leases(everything)
+
+    def release_connections(self):
+        self.inner.release_connections()
+
+    def close(self):
+        self.inner.close()
+        self.lookup.close()
@@ -0,0 +1,131 @@
+import threading
+import time
+
+DEFAULT_LEASE_TTL = 1.0
+# Bodies larger than this are not held in memory for the length of a lease
+MAX_LEASED_SIZE = 64 * 1024
+
+
+# A block of view slots one process has reserved for a note. granted slots
+# were added to current_views (and leased_views) in the database when the
+# lease was taken; used counts the ones actually shown. For notes without a
+# view limit nothing is reserved up front (granted is just the first view)
+# and every later view is written back at flush time. final means the lease
+# took the note to max_views, so whoever shows its last slot deletes the note
+# unless other leases are still out.
+class Lease:
+    __slots__ = ('granted', 'used', 'limited', 'content', 'expires_at', 'deadline', 'final')
+
+    def __init__(self, granted, limited, content, expires_at, deadline, final):
+        self.granted = granted
+        self.used = 1
+        self.limited = limited
+        self.content = content
+        self.expires_at = expires_at
+        self.deadline = deadline
+        self.final = final
+
+    # Views to add to current_views when the lease is handed back (negative
+    # for slots reserved but never shown)
+    @property
+    def delta(self):
+        return self.used - self.granted
+
+    # Slots this lease holds in the note's leased_views
+    @property
+    def reserved(self):
+        return self.granted if self.limited else 0
+
+
+# Per-process leases by note id
+class LeaseTable:
+    def __init__(self, ttl=DEFAULT_LEASE_TTL):
+        self.ttl = ttl
+        self._leases = {}
+        self._retired = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._next_flush = 0
+
+    # Use one slot of a live lease. Returns (content, finished) where finished
+    # is the lease when this was the final slot of a final lease (it is no
+    # longer in the table and must be handed back). Returns None when there is no
+    # usable lease: the caller then holds the note's claim and must lease
+    # from the database and call release(). Other threads asking for the same
+    # note wait for that instead of all going to the database at once.
+    def take(self, note_id):
+        while True:
+            with self._lock:
+                taken = self._take(note_id)
+                if taken is not None:
+                    return taken
+                pending = self._pending.get(note_id)
+                if pending is None:
+                    self._pending[note_id] = threading.Event()
+                    return None
+            pending.wait(self.ttl)
+
+    def _take(self, note_id):
+        lease = self._leases.get(note_id)
+        if lease is None or lease.deadline <= time.time():
+            return None
+        if lease.expires_at and lease.expires_at <= time.time():
+            return None
+        if lease.limited and lease.used >= lease.granted:
+            return None
+        lease.used += 1
+        if lease.final and lease.used >= lease.granted:
+            del self._leases[note_id]
+            return lease.content, lease
+        return lease.content, None
+
+    # Give up the claim taken by a take() that returned None
+    def release(self, note_id):
+        with self._lock:
+            pending = self._pending.pop(note_id, None)
+        if pending is not None:
+            pending.set()
+
+    # Two threads can lease the same note at once; a live lease absorbs the
+    # new one so none of its slots are stranded.
+    def add(self, note_id, lease):
+        with self._lock:
+            old = self._leases.get(note_id)
+            if old is not None and old.deadline > time.time():
+                old.granted += lease.granted
+                old.used += lease.used
+                old.final = old.final or lease.final
+                old.deadline = max(old.deadline, lease.deadline)
+                return
+            if old is not None:
+                self._retired.append((note_id, old))
+            self._leases[note_id] = lease
+
+    def discard(self, note_id):
+        with self._lock:
+            self._leases.pop(note_id, None)
+
+    # Remove and return the note's lease, if any, to hand it back. Only for
+    # the holder of the claim from take(), when the lease is no longer usable.
+    def pop(self, note_id):
+        with self._lock:
+            return self._leases.pop(note_id, None)
+
+    # Remove and return (note_id, lease) for every lease past its deadline, or
+    # for all of them with everything=True. Cheap when nothing is due.
+    def pop_expired(self, everything=False):
+        now = time.time()
+        if not everything and now < self._next_flush:
+            return []
+        with self._lock:
+            self._next_flush = now + self.ttl / 2
+            expired, self._retired = self._retired, []
+            for note_id, lease in list(self._leases.items()):
+                if everything or lease.deadline <= now:
+                    expired.append((note_id, lease))
+                    del self._leases[note_id]
+        return expired
+
+    def __len__(self):
+        return len(self._leases)
+
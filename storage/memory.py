@@ -0,0 +1,68 @@
+import threading
+import time
+
+from storage.base import (NOTE_EXPIRED, NOTE_LAST_VIEW, NOTE_MISSING, NOTE_VIEWED,
+                          NoteExists, Storage)
+
+
+# Pure in-process engine for tests and benchmarks. State is lost on restart
+# and is not shared between workers.
+class MemoryStorage(Storage):
+    def __init__(self):
+        self._notes = {}
+        self._lock = threading.Lock()
+
+    def create(self, note_id, content, max_views=None, expires_at=None):
+        with self._lock:
+            if note_id in self._notes:
+                raise NoteExists(note_id)
+            self._notes[note_id] = {
+                'content': content,
+                'max_views': max_views,
+                'current_views': 0,
+                'expires_at': expires_at,
+            }
+
+    def consume_view(self, note_id):
+        status, content, removed = self._consume(note_id)
+        if removed:
+            self._removed(removed)
+        return status, content
+
+    # Returns (status, content, reason the note was removed or None)
+    def _consume(self, note_id):
+        now = time.time()
+        with self._lock:
+            note = self._notes.get(note_id)
+            if note is None:
+                return NOTE_MISSING, None, None
+            if note['expires_at'] and note['expires_at'] <= now:
+                del self._notes[note_id]
+                return NOTE_EXPIRED, None, 'time'
+            if note['max_views'] and note['current_views'] >= note['max_views']:
+                del self._notes[note_id]
+                return NOTE_EXPIRED, None, 'views'
+            note['current_views'] += 1
+            if note['max_views'] and note['current_views'] >= note['max_views']:
+                del self._notes[note_id]
+                return NOTE_LAST_VIEW, note['content'], 'views'
+            return NOTE_VIEWED, note['content'], None
+
+    def delete(self, note_id):
+        with self._lock:
+            self._notes.pop(note_id, None)
+
+    def sweep_expired(self, batch_size=500):
+        now = time.time()
+        with self._lock:
+            expired = [note_id for note_id, note in self._notes.items()
+                       if note['expires_at'] and note['expires_at'] <= now]
+            for note_id in expired:
+                del self._notes[note_id]
+        return len(expired)
+
+    def count(self):
+        return len(self._notes)
+
+    def __len__(self):
+        return len(self._notes)
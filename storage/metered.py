@@ -0,0 +1,63 @@
+import metrics
+from storage.base import Storage
+
+
+# Wraps an engine and counts notes created and removed for /metrics. A view
+# that finds a note past its time (or out of views) removes it lazily, which
+# the engine reports along with why; the sweeper removes expired notes in
+# bulk.
+class MeteredStorage(Storage):
+    def __init__(self, inner):
+        self.inner = inner
+        inner.report_removals(self._count_removal)
+
+    def init_schema(self):
+        self.inner.init_schema()
+
+    def create(self, note_id, content, max_views=None, expires_at=None):
+        self.inner.create(note_id, content, max_views, expires_at)
+        metrics.NOTES_CREATED.inc()
+
+    def create_many(self, notes):
+        notes = list(notes)
+        conflicts = self.inner.create_many(notes)
+        metrics.NOTES_CREATED.inc(amount=len(notes) - len(conflicts))
+        return conflicts
+
+    def create_from_stream(self, note_id, stream, size, max_views=None, expires_at=None):
+        self.inner.create_from_stream(note_id, stream, size, max_views, expires_at)
+        metrics.NOTES_CREATED.inc()
+
+    def _count_removal(self, reason, trigger):
+        metrics.NOTES_REMOVED.inc(reason, trigger)
+
+    def consume_view(self, note_id):
+        return self.inner.consume_view(note_id)
+
+    def consume_view_stream(self, note_id):
+        return self.inner.consume_view_stream(note_id)
+
+    def delete(self, note_id):
+        self.inner.delete(note_id)
+        metrics.NOTES_REMOVED.inc('deleted', 'manual')
+
+    def sweep_expired(self, batch_size=500):
+        removed = self.inner.sweep_expired(batch_size)
+        if removed:
+            metrics.NOTES_REMOVED.inc('time', 'sweep', amount=removed)
+        return removed
+
+    def count(self):
+        return self.inner.count()
+
+    def dedup_stats(self):
+        return self.inner.dedup_stats()
+
+    def flush_leases(self, everything=False):
+        return self.inner.flush_leases(everything)
+
+    def release_connections(self):
+        self.inner.release_connections()
+
+    def close(self):
+        self.inner.close()
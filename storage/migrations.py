@@ -0,0 +1,287 @@
+import os
+import time
+
+import db
+
+# Versions applied to a database, one row each. A data migration in progress
+# has started_at but no finished_at, and cursor says where its next batch
+# starts.
+METADATA = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        cursor
+    )
+'''
+
+# Rows rewritten per transaction by data migrations
+BATCH_SIZE = 1000
+# Seconds between batches, so writers queued on the lock (view_note) get in
+PAUSE = 0.002
+
+
+# One version of the schema. apply(conn) runs in the transaction that records
+# the version, so it happens completely or not at all: keep it to DDL and
+# other quick changes. batch(conn, cursor, size) rewrites data a slice at a
+# time; it does up to size rows from cursor (None the first time) and
+# returns the cursor to carry on from, or None once nothing is left. Each
+# slice commits together with its cursor, so an interrupted run resumes where
+# it stopped. Both must cope with a database that already has the change:
+# databases from before versioning start at version 0.
+class Migration:
+    def __init__(self, version, name, apply=None, batch=None):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.batch = batch
+
+
+def _run_all(statements):
+    def apply(conn):
+        for statement in statements:
+            conn.execute(statement)
+    return apply
+
+
+TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS notes (
+        id TEXT PRIMARY KEY,
+        content TEXT NOT NULL,
+        max_views INTEGER,
+        current_views INTEGER DEFAULT 0,
+        expires_at INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        encoding TEXT,
+        leased_until REAL,
+        body_id INTEGER
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_notes_expires_at ON notes (expires_at)',
+    # Deduplicated note bodies, shared by every note with the same content
+    '''
+    CREATE TABLE IF NOT EXISTS bodies (
+        id INTEGER PRIMARY KEY,
+        hash BLOB NOT NULL UNIQUE,
+        content TEXT NOT NULL,
+        encoding TEXT,
+        refs INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+)
+
+
+# Columns added to notes after the original schema
+ADDED_COLUMNS = (
+    ('encoding', 'TEXT'),
+    ('leased_until', 'REAL'),
+    ('body_id', 'INTEGER'),
+)
+
+
+def _add_columns(conn):
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(notes)')}
+    for name, declaration in ADDED_COLUMNS:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE notes ADD COLUMN {name} {declaration}')
+
+
+# A body's refs follow the notes pointing at it, whichever statement adds or
+# removes them, and the body goes with its last note
+BODY_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_body_ref AFTER INSERT ON notes
+    WHEN new.body_id IS NOT NULL
+    BEGIN
+        UPDATE bodies SET refs = refs + 1 WHERE id = new.body_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_body_unref AFTER DELETE ON notes
+    WHEN old.body_id IS NOT NULL
+    BEGIN
+        UPDATE bodies SET refs = refs - 1 WHERE id = old.body_id;
+        DELETE FROM bodies WHERE id = old.body_id AND refs <= 0;
+    END
+    ''',
+)
+
+
+# expires_at used to hold naive local ISO strings; it now holds Unix time
+# (UTC seconds). Text sorts after every number in SQLite, so the expires_at
+# index finds the rows still to do, and until they are converted they just
+# look unexpired to the sweeper (views read them as Unix time, see
+# storage.sqlite.UNIX_EXPIRES_AT). Strings SQLite can't parse count as
+# already expired.
+# Returns how many rows were converted.
+def convert_expiry(conn, size):
+    return conn.execute('''
+        UPDATE notes SET expires_at = coalesce(CAST(strftime('%s', expires_at, 'utc') AS INTEGER), 0)
+        WHERE rowid IN (SELECT rowid FROM notes WHERE expires_at >= '' LIMIT ?)
+    ''', (size,)).rowcount
+
+
+# Converted rows drop out of the index scan, so the cursor only counts them
+def _expiry_batch(conn, cursor, size):
+    converted = convert_expiry(conn, size)
+    if converted < size:
+        return None
+    return (cursor or 0) + converted
+
+
+# Views a note has out on lease in other processes: reserved and counted in
+# current_views, but not known to be shown until handed back
+def _add_leased_views(conn):
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(notes)')}
+    if 'leased_views' not in existing:
+        conn.execute('ALTER TABLE notes ADD COLUMN leased_views INTEGER NOT NULL DEFAULT 0')
+
+
+# Notes that were ever leased, for the sweeper to find the ones whose views
+# were all handed back with nobody left to delete them
+LEASED_INDEX = (
+    'CREATE INDEX IF NOT EXISTS idx_notes_leased_until ON notes (leased_until) WHERE leased_until IS NOT NULL',
+)
+
+
+# In order; add new versions at the end and never change a released one
+MIGRATIONS = (
+    Migration(1, 'create notes, bodies and the expiry index', apply=_run_all(TABLES)),
+    Migration(2, 'add encoding, leased_until and body_id to notes', apply=_add_columns),
+    Migration(3, 'count body references with triggers', apply=_run_all(BODY_TRIGGERS)),
+    Migration(4, 'store expires_at as Unix time', batch=_expiry_batch),
+    Migration(5, 'add leased_views to notes', apply=_add_leased_views),
+    Migration(6, 'index leased notes', apply=_run_all(LEASED_INDEX)),
+)
+LATEST = MIGRATIONS[-1].version
+
+
+def _has_metadata(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_migrations'").fetchone() is not None
+
+
+def current_version(conn):
+    if not _has_metadata(conn):
+        return 0
+    row = conn.execute('SELECT max(version) FROM schema_migrations WHERE finished_at IS NOT NULL').fetchone()
+    return row[0] or 0
+
+
+def _state(conn, version):
+    return conn.execute('SELECT finished_at, cursor FROM schema_migrations WHERE version = ?',
+                        (version,)).fetchone()
+
+
+def pending(conn):
+    version = current_version(conn)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+# Apply one migration, or carry on with it. Returns timings: total seconds,
+# the number of write transactions and the longest one (how long view_note
+# could have waited), and the rows changed.
+def run(conn, migration, batch_size=BATCH_SIZE, pause=PAUSE):
+    report = {'version': migration.version, 'name': migration.name,
+              'seconds': 0.0, 'transactions': 0, 'longest_transaction': 0.0, 'rows': 0}
+    start = time.perf_counter()
+
+    def timed(step):
+        began = time.perf_counter()
+        with db.transaction(conn):
+            done = step()
+        report['transactions'] += 1
+        report['longest_transaction'] = max(report['longest_transaction'], time.perf_counter() - began)
+        return done
+
+    # Recorded as started (and finished, if there is nothing to batch) along
+    # with apply. Rechecked under the write lock: another process may have
+    # got there first.
+    def begin():
+        state = _state(conn, migration.version)
+        if state is not None:
+            return state[0] is not None
+        if migration.apply is not None:
+            migration.apply(conn)
+        finished = None if migration.batch else time.time()
+        conn.execute('INSERT INTO schema_migrations (version, name, started_at, finished_at) VALUES (?, ?, ?, ?)',
+                     (migration.version, migration.name, time.time(), finished))
+        return finished is not None
+
+    def next_batch():
+        finished_at, cursor = _state(conn, migration.version)
+        if finished_at is not None:
+            return True
+        changes = conn.total_changes
+        cursor = migration.batch(conn, cursor, batch_size)
+        report['rows'] += conn.total_changes - changes
+        if cursor is None:
+            conn.execute('UPDATE schema_migrations SET cursor = NULL, finished_at = ? WHERE version = ?',
+                         (time.time(), migration.version))
+            return True
+        conn.execute('UPDATE schema_migrations SET cursor = ? WHERE version = ?', (cursor, migration.version))
+        return False
+
+    done = timed(begin)
+    while not done:
+        if pause:
+            time.sleep(pause)
+        done = timed(next_batch)
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+# Bring the database up to target (default: the latest version). Returns a
+# report per migration run.
+def migrate(conn, target=None, batch_size=BATCH_SIZE, pause=PAUSE, log=None):
+    reports = []
+    todo = pending(conn)
+    if todo:
+        conn.execute(METADATA)
+    for migration in todo:
+        if target is not None and migration.version > target:
+            break
+        report = run(conn, migration, batch_size, pause)
+        if log is not None:
+            log(report)
+        reports.append(report)
+    return reports
+
+
+def status(conn):
+    applied = {}
+    if _has_metadata(conn):
+        applied = {row[0]: row for row in conn.execute(
+            'SELECT version, started_at, finished_at, cursor FROM schema_migrations')}
+    rows = []
+    for migration in MIGRATIONS:
+        row = applied.get(migration.version)
+        state = 'pending' if row is None else 'in progress' if row[2] is None else 'applied'
+        rows.append({'version': migration.version, 'name': migration.name, 'state': state,
+                     'started_at': row and row[1], 'finished_at': row and row[2], 'cursor': row and row[3]})
+    return rows
+
+
+# Apply the pending migrations to a copy of the database at path (taken with
+# SQLite's online backup, so the app can keep running) and report how long
+# each took there. copy_path is deleted afterwards.
+def dry_run(path, copy_path, batch_size=BATCH_SIZE, pause=0, log=None):
+    pool = db.ConnectionPool(copy_path)
+    try:
+        with db.pooled(pool) as copy:
+            source = db.ConnectionPool(path)
+            try:
+                with db.pooled(source) as conn:
+                    conn.backup(copy)
+            finally:
+                source.close_all()
+            return migrate(copy, batch_size=batch_size, pause=pause, log=log)
+    finally:
+        pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(copy_path + suffix)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,102 @@
+import math
+import time
+
+from storage.base import NOTE_LAST_VIEW, NOTE_MISSING, NOTE_VIEWED, NoteExists, Storage
+from storage.resp import RespClient, RespError
+
+# View budget given to notes that only expire by time
+UNLIMITED_VIEWS = 2 ** 62
+# How long a used-up note's body survives after its last view, so a reader
+# that won an earlier view slot can still fetch it
+LAST_VIEW_GRACE_MS = 5000
+
+
+# Notes in Redis (or anything speaking its protocol). Each note is two keys:
+# the body and a counter of remaining views. Both carry the note's TTL, so
+# time expiry is handled natively and sweep_expired has nothing to do; DECR
+# on the counter hands out view slots atomically across any number of nodes.
+class RedisStorage(Storage):
+    def __init__(self, client, prefix='note:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(RespClient.from_url(url))
+
+    def _keys(self, note_id):
+        key = self.prefix + note_id
+        return key, key + ':views'
+
+    def _expiry(self, expires_at):
+        if not expires_at:
+            return ()
+        ttl_ms = math.ceil((expires_at - time.time()) * 1000)
+        return ('PX', max(ttl_ms, 1))
+
+    def create(self, note_id, content, max_views=None, expires_at=None):
+        content_key, views_key = self._keys(note_id)
+        expiry = self._expiry(expires_at)
+        # Counter second: a reader that finds the body but no counter treats
+        # the note as gone, and nobody knows the id until create returns.
+        if self.client.execute('SET', content_key, content, 'NX', *expiry) is None:
+            raise NoteExists(note_id)
+        self.client.execute('SET', views_key, max_views or UNLIMITED_VIEWS, *expiry)
+
+    # Same two steps as create, each pipelined for the whole batch
+    def create_many(self, notes):
+        notes = [(note_id, content, max_views, self._expiry(expires_at))
+                 for note_id, content, max_views, expires_at in notes]
+        if not notes:
+            return []
+        replies = self.client.pipeline(*[
+            ('SET', self._keys(note_id)[0], content, 'NX', *expiry)
+            for note_id, content, max_views, expiry in notes
+        ])
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        conflicts = [index for index, reply in enumerate(replies) if reply is None]
+        skipped = set(conflicts)
+        counters = [
+            ('SET', self._keys(note_id)[1], max_views or UNLIMITED_VIEWS, *expiry)
+            for index, (note_id, content, max_views, expiry) in enumerate(notes)
+            if index not in skipped
+        ]
+        if counters:
+            self.client.pipeline(*counters)
+        return conflicts
+
+    def consume_view(self, note_id):
+        content_key, views_key = self._keys(note_id)
+        remaining, content = self.client.pipeline(('DECR', views_key), ('GET', content_key))
+        if isinstance(remaining, RespError):
+            raise remaining
+
+        if remaining < 0 or content is None:
+            # Used up, expired or never existed. DECR on a missing key leaves
+            # a -1 counter behind, so clear it.
+            self.client.execute('DEL', views_key)
+            return NOTE_MISSING, None
+
+        if remaining == 0:
+            self.client.pipeline(('PEXPIRE', content_key, LAST_VIEW_GRACE_MS),
+                                 ('PEXPIRE', views_key, LAST_VIEW_GRACE_MS))
+            self._removed('views')
+            return NOTE_LAST_VIEW, content.decode()
+
+        return NOTE_VIEWED, content.decode()
+
+    def delete(self, note_id):
+        self.client.execute('DEL', *self._keys(note_id))
+
+    # Redis expires keys itself
+    def sweep_expired(self, batch_size=500):
+        return 0
+
+    # RespClient.close() only drops idle sockets; the client stays usable
+    def release_connections(self):
+        self.client.close()
+
+    def close(self):
+        self.client.close()
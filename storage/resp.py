@@ -0,0 +1,138 @@
+"""Minimal client for the Redis serialization protocol (RESP2).
+
+Only what the storage engines need: plain commands, pipelining and a small
+pool of sockets. Keeping it in-tree means the Redis engine works against real
+Redis, KeyDB, Dragonfly or the stand-in server without an extra dependency.
+"""
+import socket
+import threading
+from urllib.parse import unquote, urlparse
+
+
+class RespError(Exception):
+    pass
+
+
+class _Connection:
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def send(self, commands):
+        self.sock.sendall(b''.join(encode_command(args) for args in commands))
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            return RespError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(payload)
+            if count < 0:
+                return None
+            return [self.read_reply() for _ in range(count)]
+        raise RespError(f'unexpected reply {line!r}')
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def encode_command(args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+class RespClient:
+    def __init__(self, host='localhost', port=6379, db=0, password=None,
+                 timeout=5.0, max_idle=8):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parsed = urlparse(url)
+        path = parsed.path.strip('/')
+        return cls(host=parsed.hostname or 'localhost', port=parsed.port or 6379,
+                   db=int(path) if path else 0,
+                   password=unquote(parsed.password) if parsed.password else None,
+                   **kwargs)
+
+    def _connect(self):
+        conn = _Connection(self.host, self.port, self.timeout)
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            conn.send(setup)
+            for _ in setup:
+                reply = conn.read_reply()
+                if isinstance(reply, RespError):
+                    conn.close()
+                    raise reply
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    # Send several commands in one round-trip. Error replies are returned in
+    # place rather than raised so callers can inspect each result.
+    def pipeline(self, *commands):
+        conn = self._acquire()
+        try:
+            conn.send(commands)
+            replies = [conn.read_reply() for _ in commands]
+        except BaseException:
+            conn.close()
+            raise
+        self._release(conn)
+        return replies
+
+    def execute(self, *args):
+        reply = self.pipeline(args)[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,121 @@
+import itertools
+import os
+import zlib
+
+import db
+from storage.base import Storage
+from storage.leases import DEFAULT_LEASE_TTL
+from storage.sqlite import SQLiteStorage, dedup_summary
+
+
+# Files for a database split count ways: notes.db -> notes-0.db, notes-1.db...
+def shard_paths(path, count):
+    if count <= 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f'{root}-{index}{ext}' for index in range(count)]
+
+
+# Stable across processes and restarts (unlike hash()), so a note is always
+# looked for in the file it was written to
+def shard_index(note_id, count):
+    return zlib.crc32(note_id.encode()) % count
+
+
+# Notes spread over several SQLite files by a hash of their id. Each file has
+# its own write lock, so creates and views of different notes commit in
+# parallel instead of queueing for one writer. Every operation on a note
+# touches exactly one shard; sweeps, counts and schema changes visit them all.
+# Changing the number of shards moves notes: see shards.py.
+class ShardedStorage(Storage):
+    def __init__(self, shards):
+        self.shards = list(shards)
+
+    @classmethod
+    def from_path(cls, path, count, cache=None, codec=None, lease_size=0, lease_ttl=DEFAULT_LEASE_TTL,
+                  dedup_min_size=0):
+        return cls(SQLiteStorage(db.ConnectionPool(shard_path), cache, codec, lease_size, lease_ttl,
+                                 dedup_min_size)
+                   for shard_path in shard_paths(path, count))
+
+    def shard_for(self, note_id):
+        return self.shards[shard_index(note_id, len(self.shards))]
+
+    def init_schema(self):
+        for shard in self.shards:
+            shard.init_schema()
+
+    def create(self, note_id, content, max_views=None, expires_at=None):
+        self.shard_for(note_id).create(note_id, content, max_views, expires_at)
+
+    # One transaction per shard touched; conflicts are reported by position
+    # in notes like any other engine
+    def create_many(self, notes):
+        groups = {}
+        for index, note in enumerate(notes):
+            groups.setdefault(shard_index(note[0], len(self.shards)), []).append((index, note))
+        conflicts = []
+        for shard, group in groups.items():
+            taken = self.shards[shard].create_many([note for _, note in group])
+            conflicts.extend(group[position][0] for position in taken)
+        return sorted(conflicts)
+
+    def create_from_stream(self, note_id, stream, size, max_views=None, expires_at=None):
+        self.shard_for(note_id).create_from_stream(note_id, stream, size, max_views, expires_at)
+
+    def consume_view(self, note_id):
+        return self.shard_for(note_id).consume_view(note_id)
+
+    def consume_view_stream(self, note_id):
+        return self.shard_for(note_id).consume_view_stream(note_id)
+
+    def delete(self, note_id):
+        self.shard_for(note_id).delete(note_id)
+
+    def sweep_expired(self, batch_size=500):
+        return sum(shard.sweep_expired(batch_size) for shard in self.shards)
+
+    def migrate_expiry(self):
+        return sum(shard.migrate_expiry() for shard in self.shards)
+
+    def report_removals(self, listener):
+        for shard in self.shards:
+            shard.report_removals(listener)
+
+    def flush_leases(self, everything=False):
+        return sum(shard.flush_leases(everything) for shard in self.shards)
+
+    def enable_auto_vacuum(self):
+        for shard in self.shards:
+            shard.enable_auto_vacuum()
+
+    def iter_ids(self):
+        return itertools.chain.from_iterable(shard.iter_ids() for shard in self.shards)
+
+    def count(self):
+        return sum(shard.count() for shard in self.shards)
+
+    def id_watermark(self):
+        marks = [shard.id_watermark() for shard in self.shards]
+        return sum(mark[0] for mark in marks), sum(mark[1] for mark in marks)
+
+    # Bodies are shared within a shard only
+    def dedup_stats(self):
+        totals = [0, 0, 0, 0]
+        for shard in self.shards:
+            stats = shard.dedup_stats()
+            for index, value in enumerate((stats['bodies'], stats['notes'], stats['stored_bytes'],
+                                           stats['stored_bytes'] + stats['bytes_saved'])):
+                totals[index] += value
+        return dedup_summary(*totals)
+
+    def paths(self):
+        return [shard.pool.path for shard in self.shards]
+
+    def release_connections(self):
+        for shard in self.shards:
+            shard.release_connections()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
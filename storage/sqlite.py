@@ -0,0 +1,600 @@
+import atexit
+import hashlib
+import sqlite3
+import time
+
+import db
+import threads
+from compression import BLOB, Codec
+from storage import migrations
+from storage.base import (NOTE_EXPIRED, NOTE_LAST_VIEW, NOTE_MISSING, NOTE_VIEWED,
+                          NoteExists, Storage)
+from storage.leases import DEFAULT_LEASE_TTL, MAX_LEASED_SIZE, Lease, LeaseTable
+
+# A note's stored body, whether inline or shared
+BODY_QUERY = '''
+    SELECT coalesce(bodies.content, notes.content) AS content,
+           CASE WHEN notes.body_id IS NULL THEN notes.encoding ELSE bodies.encoding END AS encoding
+    FROM notes LEFT JOIN bodies ON bodies.id = notes.body_id
+    WHERE notes.id = ?
+'''
+
+# expires_at as Unix time, including rows that still hold the naive local ISO
+# text from before migration 4 (read the way it converts them; the sweeper
+# rewrites the rows), so a view of one neither trusts nor passes on a string
+UNIX_EXPIRES_AT = '''
+    CASE WHEN typeof(expires_at) = 'text'
+         THEN coalesce(CAST(strftime('%s', expires_at, 'utc') AS INTEGER), 0)
+         ELSE expires_at END
+'''
+
+# Pages handed back per incremental_vacuum call (4 KiB pages -> 4 MiB)
+VACUUM_PAGES = 1024
+# Bytes moved per step of incremental blob I/O
+STREAM_CHUNK = 64 * 1024
+# Seconds between looks at a note whose remaining views are out on lease in
+# another process
+LEASE_POLL = 0.05
+
+
+# Notes in a single SQLite file, accessed through a ConnectionPool. An optional
+# NoteCache keeps hot (already decompressed) bodies in memory; view counts
+# always come from SQLite. Large bodies are compressed by the Codec.
+#
+# With lease_size > 1, a view of a multi-view note reserves up to lease_size
+# views in one write and the process serves the rest from memory until the
+# lease runs out or lease_ttl passes; a thread then hands the unused slots
+# back in a batch. Slots are only ever granted out of max_views, so a note is
+# never shown too often. leased_views counts the slots still out, so a note
+# is only used up once they are back; a reader that finds all remaining views
+# leased elsewhere waits for them. Views reserved by a worker that dies are
+# lost once leased_until passes.
+#
+# With dedup_min_size set, bodies at least that long are stored once per
+# distinct content in the bodies table and notes point at them.
+class SQLiteStorage(Storage):
+    def __init__(self, pool, cache=None, codec=None, lease_size=0, lease_ttl=DEFAULT_LEASE_TTL,
+                 dedup_min_size=0):
+        self.pool = pool
+        self.cache = cache
+        self.codec = codec or Codec()
+        self.dedup_min_size = dedup_min_size
+        self.lease_size = lease_size
+        self.leases = LeaseTable(lease_ttl) if lease_size > 1 else None
+        self._threads = {}
+        if self.leases is not None:
+            atexit.register(self.flush_leases, everything=True)
+
+    @classmethod
+    def from_path(cls, path, cache=None, codec=None, lease_size=0, lease_ttl=DEFAULT_LEASE_TTL,
+                  dedup_min_size=0):
+        return cls(db.ConnectionPool(path), cache, codec, lease_size, lease_ttl, dedup_min_size)
+
+    # Applies whatever storage/migrations.py has that this file doesn't yet;
+    # a database that is up to date costs one query
+    def init_schema(self):
+        with db.pooled(self.pool) as conn:
+            migrations.migrate(conn)
+
+    # Convert rows still holding an ISO expiry string (see
+    # migrations.convert_expiry), a short write transaction per batch.
+    # Migration 4 converts a database once; this catches rows copied or
+    # written in the old format since.
+    def migrate_expiry(self, batch_size=migrations.BATCH_SIZE):
+        converted = 0
+        with db.pooled(self.pool) as conn:
+            while True:
+                updated = migrations.convert_expiry(conn, batch_size)
+                converted += updated
+                if updated < batch_size:
+                    return converted
+
+    # (note_id, value, encoding, max_views, expires_at, digest, content), with
+    # the body encoded ahead of any write lock. digest is set for bodies to
+    # be deduplicated; one already stored isn't encoded again (value None).
+    def _row(self, conn, note_id, content, max_views, expires_at):
+        digest = None
+        if self.dedup_min_size and len(content) >= self.dedup_min_size:
+            digest = hashlib.sha256(content.encode('utf-8')).digest()
+            if conn.execute('SELECT 1 FROM bodies WHERE hash = ?', (digest,)).fetchone():
+                return (note_id, None, None, max_views, expires_at, digest, content)
+        value, encoding = self.codec.encode(content)
+        return (note_id, value, encoding, max_views, expires_at, digest, content)
+
+    # Insert a row from _row. A deduplicated body is found by its hash or
+    # stored now; the triggers count the reference. Must run in a
+    # transaction when digest is set.
+    def _insert(self, conn, row):
+        note_id, value, encoding, max_views, expires_at, digest, content = row
+        body_id = None
+        if digest is not None:
+            found = conn.execute('SELECT id FROM bodies WHERE hash = ?', (digest,)).fetchone()
+            if found is not None:
+                body_id = found[0]
+            else:
+                if value is None:
+                    # Its body was deleted since _row looked
+                    value, encoding = self.codec.encode(content)
+                body_id = conn.execute('''
+                    INSERT INTO bodies (hash, content, encoding) VALUES (?, ?, ?) RETURNING id
+                ''', (digest, value, encoding)).fetchone()[0]
+            value, encoding = '', None
+        conn.execute('''
+            INSERT INTO notes (id, content, encoding, max_views, expires_at, body_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (note_id, value, encoding, max_views, expires_at, body_id))
+
+    def create(self, note_id, content, max_views=None, expires_at=None):
+        with db.pooled(self.pool) as conn:
+            row = self._row(conn, note_id, content, max_views, expires_at)
+            try:
+                if row[5] is None:
+                    self._insert(conn, row)
+                else:
+                    with db.transaction(conn):
+                        self._insert(conn, row)
+            except sqlite3.IntegrityError:
+                raise NoteExists(note_id) from None
+
+    # Single transaction and executemany for the whole batch. Taken ids are
+    # looked up first under the write lock, so the INSERT itself can't fail.
+    def create_many(self, notes):
+        notes = list(notes)
+        with db.pooled(self.pool) as conn:
+            # Compress before taking the write lock
+            encoded = [self._row(conn, *note) for note in notes]
+            with db.transaction(conn):
+                taken = set()
+                ids = [note[0] for note in notes]
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    taken.update(row[0] for row in conn.execute(
+                        f'SELECT id FROM notes WHERE id IN ({placeholders})', chunk))
+                rows = []
+                conflicts = []
+                for index, row in enumerate(encoded):
+                    if row[0] in taken:
+                        conflicts.append(index)
+                        continue
+                    taken.add(row[0])
+                    rows.append(row)
+                conn.executemany('''
+                    INSERT INTO notes (id, content, encoding, max_views, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [row[:5] for row in rows if row[5] is None])
+                for row in rows:
+                    if row[5] is not None:
+                        self._insert(conn, row)
+        return conflicts
+
+    # Use up one view inside a write transaction on conn. The UPDATE only
+    # matches a live note, so two concurrent readers can never both get view
+    # N. Returns (status, note, row) where row holds the stored body when
+    # fetch_content is set.
+    def _consume(self, conn, note_id, fetch_content):
+        while True:
+            row = None
+            with db.transaction(conn):
+                note = conn.execute(f'''
+                    UPDATE notes SET current_views = current_views + 1
+                    WHERE id = ?
+                      AND (expires_at IS NULL OR {UNIX_EXPIRES_AT} > ?)
+                      AND (max_views IS NULL OR current_views < max_views)
+                    RETURNING max_views, current_views, leased_views, {UNIX_EXPIRES_AT} AS expires_at
+                ''', (note_id, time.time())).fetchone()
+
+                if note is None:
+                    status, removed = self._drop_used_up(conn, note_id)
+                else:
+                    # Views leased by other processes may still be handed back
+                    last_view = bool(note['max_views']) and \
+                        note['current_views'] - note['leased_views'] >= note['max_views']
+                    if fetch_content:
+                        row = conn.execute(BODY_QUERY, (note_id,)).fetchone()
+                    if last_view:
+                        conn.execute('DELETE FROM notes WHERE id = ?', (note_id,))
+                    status = NOTE_LAST_VIEW if last_view else NOTE_VIEWED
+                    removed = 'views' if last_view else None
+            if status is not None:
+                break
+            time.sleep(LEASE_POLL)
+
+        if status == NOTE_LAST_VIEW:
+            self._invalidate(note_id)
+        if removed:
+            self._removed(removed)
+        return status, note, row
+
+    # The note is missing, expired or has no views left to grant: drop it if
+    # it is expired or every view is known to be shown. Returns (status,
+    # reason it was deleted or None); status is None when views are still out
+    # on lease in another process, which hands them back before leased_until.
+    # Past that the process is taken to be dead and its views as shown.
+    def _drop_used_up(self, conn, note_id):
+        now = time.time()
+        deleted = conn.execute(f'''
+            DELETE FROM notes WHERE id = ?
+              AND ({UNIX_EXPIRES_AT} <= ?
+                   OR (current_views >= max_views
+                       AND (current_views - leased_views >= max_views OR coalesce(leased_until, 0) < ?)))
+            RETURNING {UNIX_EXPIRES_AT} <= ? AS timed_out
+        ''', (note_id, now, now, now)).fetchone()
+        if deleted:
+            self._invalidate(note_id)
+            return NOTE_EXPIRED, 'time' if deleted['timed_out'] else 'views'
+        exists = conn.execute('SELECT 1 FROM notes WHERE id = ?', (note_id,)).fetchone()
+        return (None if exists else NOTE_MISSING), None
+
+    # Decompression happens after the commit so it never runs under the
+    # write lock.
+    def consume_view(self, note_id):
+        if self.leases is not None:
+            return self._consume_leased(note_id)
+        content = self.cache.get(note_id) if self.cache is not None else None
+        with db.pooled(self.pool) as conn:
+            status, note, row = self._consume(conn, note_id, fetch_content=content is None)
+        if note is None:
+            return status, None
+        if row is not None:
+            content = self.codec.decode(row['content'], row['encoding'])
+            if status == NOTE_VIEWED and self.cache is not None:
+                self.cache.put(note_id, content, note['expires_at'])
+        return status, content
+
+    def _consume_leased(self, note_id):
+        self.flush_leases()
+        taken = self.leases.take(note_id)
+        if taken is not None:
+            content, finished = taken
+            if finished is not None:
+                return self._finish_lease(note_id, finished), content
+            return NOTE_VIEWED, content
+
+        try:
+            while True:
+                leased = self._lease(note_id)
+                if leased is not None:
+                    return leased
+                time.sleep(LEASE_POLL)
+        finally:
+            self.leases.release(note_id)
+
+    # Reserve up to lease_size views of the note in one write and show the
+    # first of them. Our own lease on the note, used up or past its deadline,
+    # is handed back in the same write. Returns None while the note's
+    # remaining views are leased to another process.
+    def _lease(self, note_id):
+        own = self.leases.pop(note_id)
+        with db.pooled(self.pool) as conn:
+            with db.transaction(conn):
+                dropped = self._hand_back(conn, [(note_id, own)]) if own is not None else 0
+                note = conn.execute(f'''
+                    SELECT max_views, current_views, leased_views, {UNIX_EXPIRES_AT} AS expires_at,
+                           length(coalesce(bodies.content, notes.content)) AS size
+                    FROM notes LEFT JOIN bodies ON bodies.id = notes.body_id
+                    WHERE notes.id = ? AND (expires_at IS NULL OR {UNIX_EXPIRES_AT} > ?)
+                ''', (note_id, time.time())).fetchone()
+                used_up = note is None or (note['max_views'] and note['current_views'] >= note['max_views'])
+                if dropped:
+                    self._invalidate(note_id)
+                    status, removed = NOTE_EXPIRED, 'views'
+                elif used_up:
+                    status, removed = self._drop_used_up(conn, note_id)
+                else:
+                    last_view, row, lease = self._grant(conn, note_id, note)
+
+        if used_up:
+            if removed:
+                self._removed(removed)
+            return None if status is None else (status, None)
+        content = self.codec.decode(row['content'], row['encoding'])
+        if last_view:
+            self._invalidate(note_id)
+            self._removed('views')
+            return NOTE_LAST_VIEW, content
+        if lease is not None:
+            lease.content = content
+            self.leases.add(note_id, lease)
+            self._start_flusher()
+        return NOTE_VIEWED, content
+
+    # Inside _lease's transaction: take views of the live note for a lease,
+    # or just this one when the body is too large to hold or it is the last.
+    # Returns (last_view, row, lease), lease None unless one was taken; its
+    # content is filled in once decoded, after the commit.
+    def _grant(self, conn, note_id, note):
+        limited = bool(note['max_views'])
+        leasable = note['size'] <= MAX_LEASED_SIZE
+        granted = min(self.lease_size, note['max_views'] - note['current_views']) \
+            if limited and leasable else 1
+        final = limited and note['current_views'] + granted >= note['max_views']
+        # With other leases still out, the last slot may yet be followed by
+        # views they hand back
+        last_view = final and granted == 1 and not note['leased_views']
+        leasing = leasable and (granted > 1 or not limited)
+        row = conn.execute(BODY_QUERY, (note_id,)).fetchone()
+        deadline = time.time() + self.leases.ttl
+        if last_view:
+            conn.execute('DELETE FROM notes WHERE id = ?', (note_id,))
+        elif leasing:
+            # Other workers wait for the slots until a lease could have been
+            # handed back, with one more ttl of slack
+            reserved = granted if limited else 0
+            conn.execute('''
+                UPDATE notes SET current_views = current_views + ?,
+                    leased_views = leased_views + ?,
+                    leased_until = max(coalesce(leased_until, 0), ?)
+                WHERE id = ?
+            ''', (granted, reserved, deadline + self.leases.ttl, note_id))
+        else:
+            conn.execute('UPDATE notes SET current_views = current_views + 1 WHERE id = ?', (note_id,))
+        lease = Lease(granted, limited, None, note['expires_at'], deadline, final) if leasing else None
+        return last_view, row, lease
+
+    # The last slot of a lease that took the note to max_views was shown.
+    # Unless another process still has views out, or handed some back in the
+    # meantime, that was the note's last view.
+    def _finish_lease(self, note_id, lease):
+        with db.pooled(self.pool) as conn, db.transaction(conn):
+            deleted = self._hand_back(conn, [(note_id, lease)])
+        self._invalidate(note_id)
+        if deleted:
+            self._removed('views')
+            return NOTE_LAST_VIEW
+        return NOTE_VIEWED
+
+    # Inside a write transaction: slots reserved but not shown are returned,
+    # views of unlimited notes are added, and the slots leave leased_views.
+    # A note whose views are then all known to be shown is deleted here,
+    # whichever lease came back last. Returns how many notes were deleted.
+    def _hand_back(self, conn, leases):
+        conn.executemany('''
+            UPDATE notes SET current_views = current_views + ?, leased_views = max(leased_views - ?, 0)
+            WHERE id = ?
+        ''', [(lease.delta, lease.reserved, note_id) for note_id, lease in leases])
+        deleted = 0
+        for note_id, lease in leases:
+            if lease.limited and conn.execute('''
+                DELETE FROM notes WHERE id = ? AND current_views - leased_views >= max_views RETURNING id
+            ''', (note_id,)).fetchone():
+                deleted += 1
+        return deleted
+
+    # Write back views from leases past their deadline (or all of them) in one
+    # transaction
+    def flush_leases(self, everything=False):
+        if self.leases is None:
+            return 0
+        expired = [(note_id, lease) for note_id, lease in self.leases.pop_expired(everything)
+                   if lease.delta or lease.reserved]
+        if not expired:
+            return 0
+        with db.pooled(self.pool) as conn, db.transaction(conn):
+            deleted = self._hand_back(conn, expired)
+        if deleted:
+            for note_id, _ in expired:
+                self._invalidate(note_id)
+            for _ in range(deleted):
+                self._removed('views')
+        return len(expired)
+
+    # Leases must be handed back before leased_until even when no more
+    # requests come in, or other processes would take their views as lost,
+    # so a thread flushes them every ttl/4 seconds
+    def _start_flusher(self):
+        threads.start_once(self._threads, 'lease-flush', lambda: threads.PeriodicThread(
+            'lease-flush', self.leases.ttl / 4, self.flush_leases))
+
+    def _stop_flusher(self):
+        threads.stop(self._threads, 'lease-flush')
+
+    # Write the body straight from the file object into a zeroblob through
+    # incremental blob I/O, STREAM_CHUNK bytes at a time.
+    def create_from_stream(self, note_id, stream, size, max_views=None, expires_at=None):
+        with db.pooled(self.pool) as conn, db.transaction(conn):
+            try:
+                rowid = conn.execute('''
+                    INSERT INTO notes (id, content, encoding, max_views, expires_at)
+                    VALUES (?, zeroblob(?), ?, ?, ?)
+                    RETURNING rowid
+                ''', (note_id, size, BLOB, max_views, expires_at)).fetchone()[0]
+            except sqlite3.IntegrityError:
+                raise NoteExists(note_id) from None
+            with conn.blobopen('notes', 'content', rowid) as blob:
+                remaining = size
+                while remaining > 0:
+                    chunk = stream.read(min(STREAM_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    blob.write(chunk)
+                    remaining -= len(chunk)
+
+    # A second connection opens a WAL read snapshot before the view is
+    # consumed, so the body can be streamed out of that snapshot after the
+    # write transaction has committed - even when this view deleted the row
+    # (or its shared body).
+    def consume_view_stream(self, note_id):
+        reader = self.pool.acquire()
+        try:
+            reader.execute('BEGIN')
+            found = reader.execute('''
+                SELECT coalesce(bodies.rowid, notes.rowid) AS rowid,
+                       CASE WHEN notes.body_id IS NULL THEN 'notes' ELSE 'bodies' END AS body_table,
+                       CASE WHEN notes.body_id IS NULL THEN notes.encoding ELSE bodies.encoding END AS encoding
+                FROM notes LEFT JOIN bodies ON bodies.id = notes.body_id
+                WHERE notes.id = ?
+            ''', (note_id,)).fetchone()
+            if found is None:
+                status = NOTE_MISSING
+            else:
+                with db.pooled(self.pool) as conn:
+                    status = self._consume(conn, note_id, fetch_content=False)[0]
+            if status in (NOTE_VIEWED, NOTE_LAST_VIEW):
+                return status, _BlobStream(self, reader, found['body_table'], found['rowid'],
+                                           found['encoding'])
+        except BaseException:
+            self._release_reader(reader)
+            raise
+        self._release_reader(reader)
+        return status, None
+
+    def _release_reader(self, reader):
+        if reader.in_transaction:
+            reader.execute('ROLLBACK')
+        self.pool.release(reader)
+
+    # Every stored id, read from one snapshot without loading them all at once
+    def iter_ids(self):
+        with db.pooled(self.pool) as conn:
+            for row in conn.execute('SELECT id FROM notes'):
+                yield row['id']
+
+    def count(self):
+        with db.pooled(self.pool) as conn:
+            return conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+
+    # Highest rowid and row count: changes whenever notes are added or removed
+    def id_watermark(self):
+        with db.pooled(self.pool) as conn:
+            return tuple(conn.execute('SELECT coalesce(max(rowid), 0), COUNT(*) FROM notes').fetchone())
+
+    # How much the shared bodies save. Sizes are as stored (after
+    # compression); notes with inline bodies are not counted.
+    def dedup_stats(self):
+        with db.pooled(self.pool) as conn:
+            row = conn.execute('''
+                SELECT COUNT(*), coalesce(sum(refs), 0), coalesce(sum(length(content)), 0),
+                       coalesce(sum(refs * length(content)), 0)
+                FROM bodies
+            ''').fetchone()
+        return dedup_summary(*row)
+
+    def delete(self, note_id):
+        with db.pooled(self.pool) as conn:
+            conn.execute('DELETE FROM notes WHERE id = ?', (note_id,))
+        self._invalidate(note_id)
+
+    # Batched so each DELETE is a short write transaction and view_note is
+    # never stalled for long; freed pages are then returned to the filesystem.
+    def sweep_expired(self, batch_size=500):
+        self.flush_leases()
+        # Rows written in the old format by a process that predates it
+        self.migrate_expiry()
+        now = time.time()
+        removed = 0
+        with db.pooled(self.pool) as conn:
+            while True:
+                deleted = conn.execute('''
+                    DELETE FROM notes WHERE rowid IN (
+                        SELECT rowid FROM notes WHERE expires_at <= ? LIMIT ?
+                    )
+                ''', (now, batch_size)).rowcount
+                removed += deleted
+                if deleted < batch_size:
+                    break
+            used_up = self._sweep_used_up(conn, now, batch_size)
+            if removed or used_up:
+                self.reclaim_space(conn)
+        return removed
+
+    # Notes whose views have all been shown but that nobody will view again to
+    # delete: a process died holding a lease past leased_until, or an older
+    # version handed the last lease back without deleting. Reported as
+    # removed for views; sweep_expired only counts those removed for time.
+    def _sweep_used_up(self, conn, now, batch_size):
+        used_up = 0
+        while True:
+            deleted = [row['id'] for row in conn.execute('''
+                DELETE FROM notes WHERE rowid IN (
+                    SELECT rowid FROM notes
+                    WHERE leased_until IS NOT NULL AND current_views >= max_views
+                      AND (current_views - leased_views >= max_views OR leased_until < ?)
+                    LIMIT ?
+                )
+                RETURNING id
+            ''', (now, batch_size))]
+            for note_id in deleted:
+                self._invalidate(note_id)
+                self._removed('views', 'sweep')
+            used_up += len(deleted)
+            if len(deleted) < batch_size:
+                return used_up
+
+    # Return free pages to the OS, a chunk at a time so each step only holds
+    # the write lock briefly. Only possible when the database was created with
+    # auto_vacuum=INCREMENTAL (the pool sets this for new files); older files
+    # need a one-off enable_auto_vacuum().
+    def reclaim_space(self, conn, pages=VACUUM_PAGES):
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return
+        while conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+            conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+
+    # Switch an existing database to incremental auto-vacuum. This rewrites the
+    # whole file, so run it during a quiet period.
+    def enable_auto_vacuum(self):
+        with db.pooled(self.pool) as conn:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+
+    def _invalidate(self, note_id):
+        if self.cache is not None:
+            self.cache.invalidate(note_id)
+        if self.leases is not None:
+            self.leases.discard(note_id)
+
+    # Leases go back too, and their flusher stops: a forked child must not
+    # serve the parent's slots or inherit a lock the thread held
+    def release_connections(self):
+        self._stop_flusher()
+        self.flush_leases(everything=True)
+        self.pool.clear()
+
+    def close(self):
+        self._stop_flusher()
+        self.flush_leases(everything=True)
+        self.pool.close_all()
+
+
+# Stats dict from body count, notes referencing them, bytes stored for them
+# and bytes the notes would take with their own copies
+def dedup_summary(bodies, notes, stored_bytes, referenced_bytes):
+    return {
+        'bodies': bodies,
+        'notes': notes,
+        'stored_bytes': stored_bytes,
+        'bytes_saved': referenced_bytes - stored_bytes,
+        'dedup_ratio': round(referenced_bytes / stored_bytes, 3) if stored_bytes else None,
+    }
+
+
+# Iterable over a note body read from a pooled connection's snapshot. The
+# connection goes back to the pool when iteration finishes or when the WSGI
+# server calls close() (e.g. the client disconnected).
+class _BlobStream:
+    def __init__(self, storage, reader, table, rowid, encoding):
+        self.storage = storage
+        self.reader = reader
+        self.blob = reader.blobopen(table, 'content', rowid, readonly=True)
+        self.chunks = storage.codec.iter_decode(iter(self._read, b''), encoding)
+
+    def _read(self):
+        return self.blob.read(STREAM_CHUNK)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.reader is None:
+            return
+        self.blob.close()
+        self.storage._release_reader(self.reader)
+        self.reader = None
@@ -0,0 +1,135 @@
+"""Background deletion of time-expired notes.
+
+Notes are otherwise only removed when somebody requests them, so unread notes
+would sit in storage forever. Each pass asks the storage engine to delete its
+expired notes; the SQLite engine does this in small batches (each its own
+short write transaction, so view_note is never stalled for long) and hands the
+freed pages back to the filesystem with incremental vacuum.
+
+Run it inside the app by setting SWEEP_INTERVAL (seconds), or as a separate
+process. Every worker runs the in-app sweeper, but for SQLite they share a
+lock file next to the database (<database>.sweep) that records when the last
+sweep started, so only one of them sweeps at a time and the others skip
+rounds that come less than half an interval after it:
+
+    python sweeper.py --interval 60
+    python sweeper.py --once
+"""
+import argparse
+import fcntl
+import logging
+import time
+
+import storage
+import threads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+# Periodic sweep on a daemon thread, or in the foreground with run().
+# Sweepers given the same lock_path take turns (see sweep_if_due).
+class Sweeper(threads.PeriodicThread):
+    def __init__(self, store, interval, batch_size=DEFAULT_BATCH_SIZE, lock_path=None):
+        super().__init__('note-sweeper', interval, self.sweep_if_due)
+        self.store = store
+        self.batch_size = batch_size
+        self.lock_path = lock_path
+
+    def run_once(self):
+        removed = self.store.sweep_expired(self.batch_size)
+        logger.info('sweeper removed %d expired notes', removed)
+        return removed
+
+    # Sweep unless another process is sweeping right now or started a sweep
+    # less than half an interval ago; half, so that the process that swept
+    # last is not skipped for waking a moment early. The lock file holds the
+    # time the last sweep started.
+    def sweep_if_due(self):
+        if self.lock_path is None:
+            return self.run_once()
+        with open(self.lock_path, 'a+') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                fh.seek(0)
+                try:
+                    started = float(fh.read() or 0)
+                except ValueError:
+                    started = 0
+                now = time.time()
+                if now - started < self.interval / 2:
+                    return 0
+                fh.truncate(0)
+                fh.write(repr(now))
+                fh.flush()
+                return self.run_once()
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+# Lock file the sweepers of one SQLite database share (None for other engines)
+def lock_path(app):
+    return app.config['DATABASE'] + '.sweep' if storage.database_paths(app) else None
+
+
+# Start the in-process sweeper if SWEEP_INTERVAL is configured. Nothing
+# starts here (see threads.start_once): the sweeper comes up in the process
+# that actually serves requests, on its first request (or from the gunicorn
+# post_worker_init hook).
+def init_app(app):
+    if not app.config.get('SWEEP_INTERVAL'):
+        return
+
+    @app.before_request
+    def start_sweeper():
+        start(app)
+
+
+# Sweeper for this process, started on first call
+def start(app):
+    interval = app.config.get('SWEEP_INTERVAL')
+    if not interval:
+        return None
+    return threads.start_once(app.extensions, 'sweeper', lambda: Sweeper(
+        storage.get_storage(app), float(interval), int(app.config.get('SWEEP_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+        lock_path(app)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete expired EphemeralBin notes.')
+    parser.add_argument('--database', default='notes.db')
+    parser.add_argument('--shards', type=int, default=1, help='number of database shards')
+    parser.add_argument('--storage-url', help='storage URL; overrides --database')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=60,
+                        help='seconds between sweeps')
+    parser.add_argument('--once', action='store_true', help='run a single sweep and exit')
+    parser.add_argument('--enable-auto-vacuum', action='store_true',
+                        help='convert a SQLite database to incremental auto-vacuum and exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    store = storage.create_storage(args.storage_url or f'sqlite:///{args.database}?shards={args.shards}')
+    try:
+        if args.enable_auto_vacuum:
+            store.enable_auto_vacuum()
+            return
+        # Take turns with the app's own sweepers on the same database
+        shared = None if args.storage_url else args.database + '.sweep'
+        sweeper = Sweeper(store, args.interval, args.batch_size, shared)
+        if args.once:
+            sweeper.run_once()
+            return
+        sweeper.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+
+
+# Calls func every interval seconds on a daemon thread until stopped. An
+# exception is logged and the next round runs as usual.
+class PeriodicThread(threading.Thread):
+    def __init__(self, name, interval, func):
+        super().__init__(name=name, daemon=True)
+        self.interval = interval
+        self.func = func
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.func()
+            except Exception:
+                logger.exception('%s failed', self.name)
+
+    def stop(self):
+        self._stopped.set()
+
+
+# Background threads are started lazily, once per process: a preloading
+# server forks its workers from a master that must not have any (they could
+# hold a lock at the fork), and a forked child has none of its parent's
+# threads anyway. start_once returns the thread stored under key in registry
+# (any dict: app.extensions, or an object's own), calling factory() for a
+# new one and starting it unless this process already has one.
+def start_once(registry, key, factory):
+    thread = current(registry, key)
+    if thread is not None:
+        return thread
+    with _lock:
+        thread = current(registry, key)
+        if thread is None:
+            thread = factory()
+            thread.pid = os.getpid()
+            thread.start()
+            registry[key] = thread
+    return thread
+
+
+# This process's thread under key, or None (never started, or inherited
+# from the parent and so not running)
+def current(registry, key):
+    thread = registry.get(key)
+    if thread is not None and thread.pid == os.getpid():
+        return thread
+    return None
+
+
+# Stop this process's thread under key, if any, and wait for it to finish
+def stop(registry, key):
+    with _lock:
+        thread = registry.pop(key, None)
+    if thread is not None and thread.pid == os.getpid():
+        thread.stop()
+        thread.join()